@@ -0,0 +1,75 @@
+"""Compares ttgpt.split_text (and StreamChunker) against the original split_string from bot.py on large replies.
+
+Run from the repository root:
+	python benchmarks/bench_chunker.py
+"""
+
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ttgpt.chunker import split_text, StreamChunker
+
+
+# the implementation split_text replaced, kept here for comparison
+def legacy_split_string(string):
+	chunks = []
+	while len(string) > 500:
+		end = string[:500].rfind(".")
+		if end == -1:
+			end = 500
+		chunks.append(string[:end+1])
+		string = string[end+1:]
+	chunks.append(string)
+	return chunks
+
+
+def reply(size, multibyte=False):
+	"""Builds a reply of about size characters made of paragraphs of sentences"""
+	sentence = "Die Größe der Nachricht zählt in Bytes, nicht in Zeichen — 東京は大きい. " if multibyte else "The quick brown fox jumps over the lazy dog near the river bank. "
+	paragraph = sentence * 6 + "\n\n"
+	return (paragraph * (size // len(paragraph) + 1))[:size]
+
+
+def stream(text, limit=500, piece=4):
+	"""Feeds text to a StreamChunker a few characters at a time, like a streamed completion"""
+	chunker = StreamChunker(limit)
+	chunks = []
+	for i in range(0, len(text), piece):
+		chunks += chunker.feed(text[i:i + piece])
+	return chunks + chunker.flush()
+
+
+def check(text, limit=500):
+	chunks = split_text(text, limit)
+	for chunk in chunks:
+		if len(chunk.encode("utf-8")) > limit:
+			raise AssertionError(f"chunk of {len(chunk.encode('utf-8'))} bytes is over the limit of {limit}")
+	if stream(text, limit) != chunks:
+		raise AssertionError("StreamChunker and split_text disagree")
+
+
+def bench(func, text, number=3):
+	return min(timeit.repeat(lambda: func(text), number=1, repeat=number))
+
+
+def main():
+	for multibyte in (False, True):
+		for size in (10_000, 100_000, 1_000_000):
+			text = reply(size, multibyte)
+			check(text)
+			legacy = bench(legacy_split_string, text)
+			current = bench(split_text, text)
+			streamed = bench(stream, text)
+			kind = "multibyte" if multibyte else "ascii"
+			print(f"{kind} {size:,} chars ({len(text.encode('utf-8')):,} bytes)")
+			print(f"  legacy:   {legacy * 1000:9.2f} ms")
+			print(f"  current:  {current * 1000:9.2f} ms ({legacy / current:.1f}x)")
+			print(f"  streamed: {streamed * 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,79 @@
+"""Compares eager parse_tt_message against lazy=True (LazyParams), for handlers that read a few fields and for ones that read them all.
+
+Run from the repository root:
+	python benchmarks/bench_params.py
+"""
+
+
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from teamtalk import parse_tt_message
+
+
+LINES = {
+	"messagedeliver": ('messagedeliver type=2 srcuserid=3 chanid=1 content="@gpt what is the capital of France? Answer in one \\"word\\"."', ("type", "srcuserid", "content")),
+	"adduser": ('adduser userid=12 nickname="User number 12" username="user12" ipaddr="10.0.12.0" version="5.8.1.4991" packetprotocol=1 usertype=1 statusmode=0 statusmsg="" clientname="TeamTalk" sublocal=15 subpeer=287 userdata=0 chanid=3', ("userid", "chanid")),
+	"updateuser": ('updateuser userid=12 nickname="User number 12" username="user12" ipaddr="10.0.12.0" udpaddr="10.0.12.0:50212" version="5.8.1.4991" packetprotocol=1 usertype=1 userrights=0 statusmode=1 statusmsg="Away for a bit" clientname="TeamTalk" sublocal=15 subpeer=287 userdata=0 chanid=3', ("userid", "statusmode")),
+	"addchannel": ('addchannel chanid=2 channel="/room 2/" topic="Topic for room 2" password="" oppassword="" protected=0 maxusers=1000 audiocodec=[3,48000,2,64000,10,1,0,128000,1,0,0,1] audioconfig=[0,0] type=0 userdata=0 parentid=1 diskquota=0 operators=[] transmitswitchdelay=500 totvoice=0', ("chanid", "channel")),
+}
+
+
+def check():
+	for event, (line, fields) in LINES.items():
+		expected = parse_tt_message(line)
+		lazy_event, params = parse_tt_message(line, lazy=True)
+		if lazy_event != expected[0] or any(params[field] != expected[1][field] for field in fields) or dict(params) != expected[1]:
+			raise AssertionError(f"lazy and eager parsing disagree on {event}")
+
+
+def read(fields, lazy):
+	def func(line):
+		event, params = parse_tt_message(line, lazy)
+		for field in fields:
+			params[field]
+	return func
+
+
+def read_all(lazy):
+	def func(line):
+		event, params = parse_tt_message(line, lazy)
+		dict(params)
+	return func
+
+
+def bench(func, line, number):
+	return min(timeit.repeat(lambda: func(line), number=number, repeat=3)) / number
+
+
+def allocated(func, line, number=1000):
+	"""Returns the peak bytes allocated while keeping the results of number calls"""
+	tracemalloc.start()
+	kept = [func(line) for i in range(number)]
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return peak / number
+
+
+def main(number=50000):
+	check()
+	for event, (line, fields) in LINES.items():
+		eager = bench(read(fields, False), line, number)
+		lazy = bench(read(fields, True), line, number)
+		eager_all = bench(read_all(False), line, number)
+		lazy_all = bench(read_all(True), line, number)
+		eager_bytes = allocated(lambda line: parse_tt_message(line)[1], line)
+		lazy_bytes = allocated(lambda line: parse_tt_message(line, True)[1], line)
+		print(f"{event} ({len(line)} chars), reading {', '.join(fields)}")
+		print(f"  eager:          {eager * 1e6:7.2f} us, {eager_bytes:6.0f} bytes kept")
+		print(f"  lazy:           {lazy * 1e6:7.2f} us, {lazy_bytes:6.0f} bytes kept before reading ({eager / lazy:.1f}x)")
+		print(f"  eager, all:     {eager_all * 1e6:7.2f} us")
+		print(f"  lazy, all:      {lazy_all * 1e6:7.2f} us")
+
+
+if __name__ == "__main__":
+	main()
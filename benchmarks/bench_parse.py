@@ -0,0 +1,103 @@
+"""Compares parse_tt_message against the original character by character implementation.
+
+Run from the repository root:
+	python benchmarks/bench_parse.py
+"""
+
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import teamtalk
+
+
+# the implementation parse_tt_message replaced, kept here for comparison
+def legacy_split_quoted(message):
+	pos = -1
+	inquote = False
+	buffer = ""
+	final = []
+	while pos < len(message)-1:
+		pos += 1
+		token = message[pos]
+		if token == " " and not inquote:
+			final.append(buffer)
+			buffer = ""
+			continue
+		if token == "\"" and message[pos-1] != "\\":
+			inquote = not inquote
+		buffer += token
+	final.append(buffer)
+	return final
+
+
+def legacy_parse_tt_message(message):
+	params = {}
+	message = message.strip()
+	message = legacy_split_quoted(message)
+	event = message[0]
+	message.remove(event)
+	for item in message:
+		index = item.find("=")
+		k, v = item[:index], item[index+1:]
+		if v.startswith("[") and v.endswith("]"):
+			v = v.strip("[]")
+			if v:
+				v = [int(val) if val.isdigit() else val for val in v.split(",")]
+			else:
+				v = []
+		elif v.isdigit():
+			v = int(v)
+		elif v.startswith('"') and v.endswith('"'):
+			v = v[1:-1]
+		params[k] = v
+	return event, params
+
+
+def login_flood(users=500, channels=100):
+	"""Builds the lines a server sends while logging in to a busy server"""
+	lines = []
+	for i in range(1, channels + 1):
+		lines.append(f'addchannel chanid={i} channel="/room {i}/" topic="Topic for room {i}, with \\"quotes\\"" password="" oppassword="" protected=0 maxusers=1000 audiocodec=[3,48000,2,64000,10,1,0,128000,1,0,0,1] audioconfig=[0,0] type=0 userdata=0 parentid=1 diskquota=0 operators=[] voiceusers=[] videousers=[] desktopusers=[] mediafileusers=[] transmitswitchdelay=500 totvoice=0')
+	for i in range(1, users + 1):
+		lines.append(f'loggedin userid={i} nickname="User number {i}" username="user{i}" ipaddr="10.0.{i % 256}.{i // 256}" version="5.8.1.4991" packetprotocol=1 usertype=1 statusmode=0 statusmsg="Listening to \\"some music\\"" clientname="TeamTalk" sublocal=15 subpeer=287 userdata=0')
+		lines.append(f'adduser userid={i} chanid={i % channels + 1} nickname="User number {i}" username="user{i}"')
+	lines.append('messagedeliver type=2 srcuserid=3 chanid=4 content="@gpt what is the capital of France?"')
+	lines.append("pong")
+	return lines
+
+
+def check(lines):
+	for line in lines:
+		event, params = legacy_parse_tt_message(line)
+		# the original left escapes in strings, parse_tt_message undoes them
+		expected = event, {k: teamtalk.unescape(v) if isinstance(v, str) else v for k, v in params.items()}
+		got = teamtalk.parse_tt_message(line)
+		if expected != got:
+			raise AssertionError(f"mismatch for {line!r}:\n{expected!r}\n{got!r}")
+
+
+def bench(func, lines, number=5):
+	def run():
+		for line in lines:
+			func(line)
+	return min(timeit.repeat(run, number=1, repeat=number))
+
+
+def main():
+	lines = login_flood()
+	check(lines)
+	total = sum(len(line) for line in lines)
+	legacy = bench(legacy_parse_tt_message, lines)
+	current = bench(teamtalk.parse_tt_message, lines)
+	print(f"{len(lines)} lines, {total} bytes")
+	print(f"legacy:  {legacy * 1000:.2f} ms ({len(lines) / legacy:,.0f} lines/s)")
+	print(f"current: {current * 1000:.2f} ms ({len(lines) / current:,.0f} lines/s)")
+	print(f"speedup: {legacy / current:.1f}x")
+
+
+if __name__ == "__main__":
+	main()
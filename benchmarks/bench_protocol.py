@@ -0,0 +1,109 @@
+"""Checks that build_tt_message and parse_tt_message round trip, then compares building messages against the original builder.
+
+The round trip check builds messages from random parameters (strings full of quotes, backslashes, line breaks, "=" and non ASCII text, negative numbers, lists),
+and makes sure parsing them, eagerly and lazily, gives the same parameters back.
+
+Run from the repository root:
+	python benchmarks/bench_protocol.py
+"""
+
+
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from teamtalk import build_tt_message, build_tt_line, parse_tt_message, TeamTalkServer
+
+
+# the implementation build_tt_message replaced, kept here for comparison
+def legacy_build_tt_message(event, params):
+	message = event
+	for key, val in params.items():
+		message += " " + key + "="
+		if isinstance(val, int) or isinstance(val, str) and val.isdigit():
+			message += str(val)
+		elif isinstance(val, list):
+			message += "["
+			for v in val:
+				if isinstance(v, int) or isinstance(v, str) and v.isdigit():
+					message += str(v) + ","
+				else:
+					message += '"' + v + '",'
+			if len(val) > 0:
+				message = message[:-1]
+			message += "]"
+		else:
+			message += '"' + val + '"'
+	return message
+
+
+def legacy_encode_line(line):
+	line = line.encode().replace(b"\n", b"\r")
+	if not line.endswith(b"\r\n"):
+		line += b"\r\n"
+	return line
+
+
+ALPHABET = 'abc XYZ 019 ="\\\n\r\t,[]-_.é東😀'
+
+
+def random_string(rng):
+	if rng.randrange(4) == 0:
+		# strings that look like numbers have to stay strings
+		return str(rng.randrange(-1000, 100000))
+	return "".join(rng.choice(ALPHABET) for i in range(rng.randrange(0, 40)))
+
+
+def random_value(rng):
+	kind = rng.randrange(4)
+	if kind == 0:
+		return rng.randrange(-100000, 100000)
+	if kind == 1:
+		return [rng.randrange(0, 100000) for i in range(rng.randrange(0, 6))]
+	return random_string(rng)
+
+
+def check(count=20000, seed=1):
+	rng = random.Random(seed)
+	for i in range(count):
+		params = {f"key{n}": random_value(rng) for n in range(rng.randrange(1, 8))}
+		line = build_tt_line("message", params)
+		if b"\n" in line[:-2] or b"\r" in line[:-2]:
+			raise AssertionError(f"unescaped line break in {line!r}")
+		for lazy in (False, True):
+			event, parsed = parse_tt_message(line.decode(), lazy)
+			if event != "message" or dict(parsed) != params:
+				raise AssertionError(f"round trip failed (lazy={lazy}): {params!r} became {dict(parsed)!r} via {line!r}")
+			if lazy and any(parse_tt_message(line.decode(), True)[1][key] != value for key, value in params.items()):
+				raise AssertionError(f"lazy lookups disagree on {line!r}")
+	return count
+
+
+def reply(size):
+	"""A reply like the ones GPT sends back, with code, quotes and line breaks"""
+	text = 'Here is how to do it:\n\n```python\nprint("hello, \\"world\\"")\npath = "C:\\\\temp\\\\file.txt"\n```\n\nThe "quotes" and \\backslashes\\ are kept.\n'
+	return (text * (size // len(text) + 1))[:size]
+
+
+def bench(func, number):
+	return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main(number=20000):
+	print(f"round trip: {check()} random messages ok")
+	for size in (50, 500, 5000):
+		params = {"type": 2, "content": reply(size), "chanid": 1, "id": 5}
+		legacy = bench(lambda: legacy_encode_line(legacy_build_tt_message("message", params)), number)
+		current = bench(lambda: TeamTalkServer._encode_line(build_tt_message("message", params)), number)
+		as_bytes = bench(lambda: build_tt_line("message", params), number)
+		print(f"message with {size} characters of content")
+		print(f"  legacy (unescaped): {legacy * 1e6:8.2f} us")
+		print(f"  build_tt_message:   {current * 1e6:8.2f} us")
+		print(f"  build_tt_line:      {as_bytes * 1e6:8.2f} us")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,104 @@
+"""Compares the memory a connection's state takes up with compact records against the plain dicts (and set per indexed value) they replaced.
+
+Run from the repository root:
+	python benchmarks/bench_state.py
+"""
+
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import teamtalk
+from bench_parse import login_flood
+
+
+class LegacyTable(teamtalk.Table):
+	"""Table as it was before records, with rows kept as the parsed dicts and a dict per indexed value"""
+
+	def add(self, row):
+		key = self.key_of(row)
+		if key in self.rows:
+			return self.update(key, row)
+		self.rows[key] = row
+		self._index(key, row, self._indexes)
+		return row
+
+	def find_all(self, fields, value):
+		return [self.rows[key] for key in self._indexes[fields].get(value, ())]
+
+	def _index(self, key, row, indexes):
+		for fields in indexes:
+			self._indexes[fields].setdefault(self._value(row, fields), {})[key] = None
+
+	def _unindex(self, key, row, indexes):
+		for fields in indexes:
+			value = self._value(row, fields)
+			keys = self._indexes[fields].get(value)
+			if keys is not None:
+				keys.pop(key, None)
+				if not keys:
+					del self._indexes[fields][value]
+
+
+def files(count, channels):
+	"""Builds the addfile lines for count files spread over channels"""
+	return [
+		f'addfile chanid={i % channels + 1} fileid={i} filename="recording {i}.ogg" filesize={i * 1024} owner="user{i % 50}"'
+		for i in range(1, count + 1)
+	]
+
+
+def load(lines, records):
+	"""Builds the users, channels and files tables from lines, the way TeamTalkServer does"""
+	if records:
+		users = teamtalk.Table("userid", ("nickname", "chanid"), teamtalk.User)
+		channels = teamtalk.Table("chanid", ("channel",), teamtalk.Channel)
+		files = teamtalk.Table(("chanid", "filename"), ("fileid", "filename"), teamtalk.File)
+	else:
+		users = LegacyTable("userid", ("nickname", "chanid"))
+		channels = LegacyTable("chanid", ("channel",))
+		files = LegacyTable(("chanid", "filename"), ("fileid", "filename"))
+	for line in lines:
+		event, params = teamtalk.parse_tt_message(line)
+		if event == "loggedin":
+			users.add(params)
+		elif event == "adduser":
+			users.update(params["userid"], params)
+		elif event == "addchannel":
+			channels.add(params)
+		elif event == "addfile":
+			files.add(params)
+	return users, channels, files
+
+
+def measure(lines, records):
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	tables = load(lines, records)
+	after = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return after - before, tables
+
+
+def main():
+	for users, channels, file_count in ((1000, 200, 2000), (5000, 1000, 10000)):
+		lines = login_flood(users, channels) + files(file_count, channels)
+		legacy, legacy_tables = measure(lines, False)
+		current, current_tables = measure(lines, True)
+		for old, new in zip(legacy_tables, current_tables):
+			if [dict(row) for row in old] != [row.to_dict() for row in new]:
+				raise AssertionError("records don't hold the same data as the dicts")
+			for fields in old._indexes:
+				for value in old._indexes[fields]:
+					if old.find_all(fields, value) != new.find_all(fields, value):
+						raise AssertionError(f"indexes on {fields} differ")
+		print(f"{users} users, {channels} channels, {file_count} files")
+		print(f"  dicts:   {legacy / 1024:10,.0f} KiB")
+		print(f"  records: {current / 1024:10,.0f} KiB ({legacy / current:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+	main()
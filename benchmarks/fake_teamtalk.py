@@ -0,0 +1,172 @@
+"""A scriptable stand-in for a TeamTalk 5 server, speaking just enough of the TCP protocol for TeamTalkServer and the bot.
+
+Clients get the teamtalk welcome, then a login flood of users and channels when they log in.
+join, message and ping are answered, and everything a client sends is recorded with the time it arrived.
+Messages can be delivered to clients on demand, one at a time or as a sustained flood.
+"""
+
+
+import os
+import sys
+import time
+import socket
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import teamtalk
+
+
+class FakeClient:
+	"""A client connected to a FakeTeamTalkServer"""
+
+	def __init__(self, server, sock):
+		self.server = server
+		self.sock = sock
+		self.userid = None
+		self.chanid = None
+		self._lock = threading.Lock()
+
+	def send(self, data):
+		"""Sends lines (bytes, already terminated) to the client"""
+		with self._lock:
+			self.sock.sendall(data)
+
+	def close(self):
+		try:
+			self.sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+		self.sock.close()
+
+
+class FakeTeamTalkServer:
+	"""Serves fake TeamTalk sessions on a background thread.
+	users and channels set the size of the login flood, usertimeout is advertised in the welcome message.
+	received is a list of (time.monotonic(), client, event, params) for every line a client sent.
+	on_line, if set, is called with each of those as they arrive."""
+
+	def __init__(self, host="127.0.0.1", port=0, users=100, channels=10, usertimeout=60):
+		self.users = users
+		self.channels = channels
+		self.usertimeout = usertimeout
+		self.received = []
+		self.on_line = None
+		self.clients = []
+		self._next_userid = users + 1
+		self._lock = threading.Lock()
+		self._flood = self._build_flood()
+		self.sock = socket.socket()
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.sock.bind((host, port))
+		self.sock.listen()
+		self._closed = False
+		self._thread = None
+
+	@property
+	def address(self):
+		return self.sock.getsockname()[:2]
+
+	def _build_flood(self):
+		"""Returns the channels and users sent to every client that logs in, as bytes"""
+		lines = []
+		for i in range(1, self.channels + 1):
+			path = "/" if i == 1 else f"/room {i}/"
+			lines.append(f'addchannel chanid={i} channel="{path}" topic="Topic for room {i}" password="" oppassword="" protected=0 maxusers=1000 audiocodec=[3,48000,2,64000,10,1,0,128000,1,0,0,1] audioconfig=[0,0] type=0 userdata=0 parentid={0 if i == 1 else 1} diskquota=0 operators=[] transmitswitchdelay=500 totvoice=0')
+		for i in range(1, self.users + 1):
+			lines.append(f'loggedin userid={i} nickname="User number {i}" username="user{i}" ipaddr="10.0.{i % 256}.{i // 256}" version="5.8.1.4991" packetprotocol=1 usertype=1 statusmode=0 statusmsg="" clientname="TeamTalk" sublocal=15 subpeer=287 userdata=0')
+			lines.append(f'adduser userid={i} chanid={i % self.channels + 1}')
+		return "".join(line + "\r\n" for line in lines).encode()
+
+	def start(self):
+		self._thread = threading.Thread(target=self._accept, name="fake-teamtalk-server")
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._closed = True
+		self.sock.close()
+		for client in list(self.clients):
+			client.close()
+
+	def _accept(self):
+		while not self._closed:
+			try:
+				sock, address = self.sock.accept()
+			except OSError:
+				return
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			client = FakeClient(self, sock)
+			with self._lock:
+				self.clients.append(client)
+			thread = threading.Thread(target=self._serve, args=(client,), name="fake-teamtalk-client")
+			thread.daemon = True
+			thread.start()
+
+	def _serve(self, client):
+		client.send(f'teamtalk userid=0 servername="Fake server" maxusers=10000 protocol="5.6" usertimeout={self.usertimeout}\r\n'.encode())
+		try:
+			for line in client.sock.makefile("rb"):
+				line = line.strip()
+				if not line:
+					continue
+				event, params = teamtalk.parse_tt_message(line.decode())
+				record = (time.monotonic(), client, event, params)
+				self.received.append(record)
+				if self.on_line:
+					self.on_line(*record)
+				self._respond(client, event, params)
+		except OSError:
+			pass
+		with self._lock:
+			if client in self.clients:
+				self.clients.remove(client)
+
+	def _respond(self, client, event, params):
+		id = params.get("id")
+		if event == "ping":
+			client.send(b"pong\r\n")
+			return
+		if event == "login":
+			with self._lock:
+				client.userid = self._next_userid
+				self._next_userid += 1
+			client.send(
+				f"begin id={id}\r\n".encode()
+				+ f'accepted userid={client.userid} nickname="{params.get("nickname", "")}" username="{params.get("username", "")}" usertype=1\r\n'.encode()
+				+ f"serverupdate usertimeout={self.usertimeout}\r\n".encode()
+				+ self._flood
+				+ f'loggedin userid={client.userid} nickname="{params.get("nickname", "")}"\r\n'.encode()
+				+ f"end id={id}\r\n".encode()
+			)
+			return
+		body = b""
+		if event == "join":
+			client.chanid = params["chanid"]
+			body = f"joined chanid={client.chanid}\r\nadduser userid={client.userid} chanid={client.chanid}\r\n".encode()
+		if id:
+			client.send(f"begin id={id}\r\n".encode() + body + f"end id={id}\r\n".encode())
+		elif body:
+			client.send(body)
+
+	def deliver(self, content, srcuserid=1, type=teamtalk.USER_MSG, chanid=None, client=None):
+		"""Sends a messagedeliver event to client (by default, every connected client)"""
+		params = {"type": type, "srcuserid": srcuserid, "content": content}
+		if chanid is not None:
+			params["chanid"] = chanid
+		line = (teamtalk.build_tt_message("messagedeliver", params) + "\r\n").encode()
+		for target in [client] if client else list(self.clients):
+			target.send(line)
+
+	def flood(self, count, client=None, batch=100):
+		"""Delivers count channel messages to client (by default, every connected client) as fast as the socket takes them"""
+		lines = [
+			(teamtalk.build_tt_message("messagedeliver", {"type": teamtalk.CHANNEL_MSG, "srcuserid": i % self.users + 1, "chanid": 1, "content": f"message number {i}"}) + "\r\n").encode()
+			for i in range(count)
+		]
+		targets = [client] if client else list(self.clients)
+		for i in range(0, count, batch):
+			data = b"".join(lines[i:i + batch])
+			for target in targets:
+				target.send(data)
@@ -0,0 +1,282 @@
+"""Protocol level benchmarks against a local fake TeamTalk server, with results as JSON so they can be compared over time.
+
+Measures:
+	connect_login	TeamTalkServer.connect and login against a login flood of --users users and --channels channels
+	throughput	how many messagedeliver lines per second handle_messages gets through
+	parse	the cost of parse_tt_message, and of _process_line (parsing plus keeping state), per kind of line
+	lookups	get_user and get_channel with the state from the login flood
+	dispatch	_process_line on messages for a channel nobody subscribes to, dropped unparsed against parsed and then filtered
+	bot	the bot's reply latency, from a message arriving to the first line of its reply, against ttgpt.fake_server, and how many of its connections to it were reused
+
+Run from the repository root:
+	python benchmarks/harness.py --output results.json
+"""
+
+
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import teamtalk
+from fake_teamtalk import FakeTeamTalkServer
+
+
+def percentiles(values):
+	"""Returns a summary of values (seconds) in milliseconds"""
+	if not values:
+		return {}
+	values = sorted(values)
+
+	def at(fraction):
+		return round(values[min(len(values) - 1, int(fraction * len(values)))] * 1000, 3)
+
+	return {
+		"count": len(values),
+		"mean_ms": round(sum(values) / len(values) * 1000, 3),
+		"p50_ms": at(0.5),
+		"p95_ms": at(0.95),
+		"p99_ms": at(0.99),
+		"max_ms": round(values[-1] * 1000, 3),
+	}
+
+
+def login(server):
+	host, port = server.address
+	client = teamtalk.TeamTalkServer(host, port)
+	started = time.perf_counter()
+	client.connect()
+	connected = time.perf_counter()
+	client.login("bench", "bench", "bench", "benchmark")
+	logged_in = time.perf_counter()
+	return client, connected - started, logged_in - connected
+
+
+def bench_connect_login(server, repeat):
+	connects = []
+	logins = []
+	for i in range(repeat):
+		client, connect, login_time = login(server)
+		client.disconnect()
+		connects.append(connect)
+		logins.append(login_time)
+	return {
+		"users": server.users,
+		"channels": server.channels,
+		"connect": percentiles(connects),
+		"login": percentiles(logins),
+	}
+
+
+def bench_throughput(server, count):
+	client, connect, login_time = login(server)
+	fake_client = server.clients[-1]
+	done = threading.Event()
+	received = [0]
+
+	def on_message(server, params):
+		received[0] += 1
+		if received[0] == count:
+			done.set()
+
+	client.subscribe("messagedeliver", on_message)
+	reader = threading.Thread(target=client.handle_messages, args=(0.5,), daemon=True)
+	reader.start()
+	started = time.perf_counter()
+	server.flood(count, fake_client)
+	done.wait(60)
+	elapsed = time.perf_counter() - started
+	client.disconnect()
+	return {
+		"lines": received[0],
+		"seconds": round(elapsed, 4),
+		"lines_per_second": round(received[0] / elapsed),
+	}
+
+
+def bench_parse(server, number):
+	lines = server._flood.decode().split("\r\n")
+	samples = {
+		"addchannel": next(line for line in lines if line.startswith("addchannel")),
+		"loggedin": next(line for line in lines if line.startswith("loggedin")),
+		"adduser": next(line for line in lines if line.startswith("adduser")),
+		"messagedeliver": teamtalk.build_tt_message("messagedeliver", {"type": teamtalk.CHANNEL_MSG, "srcuserid": 3, "chanid": 1, "content": "@gpt what is the capital of France?"}),
+	}
+	results = {}
+	for kind, line in samples.items():
+		seconds = min(timeit.repeat(lambda: teamtalk.parse_tt_message(line), number=number, repeat=3))
+		results[kind] = {"parse_us": round(seconds / number * 1e6, 3)}
+	# _process_line on a server that isn't connected, which also keeps the users and channels tables
+	flood = [line.encode() + b"\r\n" for line in lines if line]
+	started = time.perf_counter()
+	state = teamtalk.TeamTalkServer()
+	for line in flood:
+		state._process_line(line)
+	elapsed = time.perf_counter() - started
+	results["login_flood"] = {"lines": len(flood), "process_us": round(elapsed / len(flood) * 1e6, 3)}
+	return results, state
+
+
+def bench_lookups(state, number):
+	users = len(state.users)
+	middle = users // 2 or 1
+	nickname = f"User number {middle}"
+	channel = "/room 2/"
+	results = {}
+	for name, func in (
+		("get_user_by_id", lambda: state.get_user(middle)),
+		("get_user_by_nickname", lambda: state.get_user(nickname)),
+		("get_channel_by_path", lambda: state.get_channel(channel)),
+		("get_users_in_channel", lambda: state.get_users_in_channel(1)),
+	):
+		seconds = min(timeit.repeat(func, number=number, repeat=3))
+		results[name] = {"us": round(seconds / number * 1e6, 3)}
+	return results
+
+
+def bench_dispatch(number):
+	client = teamtalk.TeamTalkServer()
+	client.subscribe("messagedeliver", lambda server, params: None, where={"type": teamtalk.CHANNEL_MSG, "chanid": 1})
+	line = (teamtalk.build_tt_message("messagedeliver", {"type": teamtalk.CHANNEL_MSG, "srcuserid": 3, "chanid": 2, "content": "@gpt what is the capital of France?"}) + "\r\n").encode()
+	results = {}
+	for name, parse_all in (("skipped", False), ("parsed", True)):
+		seconds = min(timeit.repeat(lambda: client._process_line(line, parse_all), number=number, repeat=3))
+		results[name] = {"process_us": round(seconds / number * 1e6, 3)}
+	return results
+
+
+def bench_bot(server, count, completion_latency, send_rate):
+	# ttgpt needs tiktoken and the rest of the bot's requirements, only import it if we get this far
+	import ttgpt
+	from ttgpt.fake_server import FakeCompletionServer
+	import bot
+
+	class ApproxCounter(ttgpt.TokenCounter):
+		"""Counts about 4 characters per token, so the benchmark doesn't need to download an encoding"""
+
+		def __init__(self):
+			pass
+
+		def count(self, text):
+			return len(text) // 4 + 1
+
+	completions = FakeCompletionServer(latency=completion_latency, tokens_per_second=10000, reply_tokens=20, keep_alive=True).start()
+	directory = tempfile.mkdtemp(prefix="ttgpt-bench-")
+	bot.server_info = {}
+	bot.pool = ttgpt.CompletionPool(4, 256)
+	bot.dispatch_pool = ThreadPoolExecutor(8, thread_name_prefix="dispatch")
+	bot.scheduler = ttgpt.ConversationScheduler(bot.dispatch_pool, 3)
+	bot.backend = ttgpt.create_backend({"type": "http", "url": completions.url, "retries": 1})
+	bot.counter = ApproxCounter()
+	bot.context_builder = ttgpt.ContextBuilder(bot.counter)
+	bot.store = ttgpt.ConversationStore(directory, 0.1)
+	host, port = server.address
+	entry = {"host": host, "port": port, "nickname": "GPTBot", "username": "bot", "password": "bot", "channel_id": 1, "send_rate": send_rate}
+
+	sent = {}
+	latencies = []
+	replied = threading.Condition()
+
+	def on_line(arrived, client, event, params):
+		if event != "message" or params.get("type") != teamtalk.USER_MSG:
+			return
+		with replied:
+			started = sent.pop(params.get("destuserid"), None)
+			if started is not None:
+				latencies.append(arrived - started)
+				replied.notify_all()
+
+	server.on_line = on_line
+	threading.Thread(target=bot.run_server, args=(entry,), daemon=True).start()
+	deadline = time.monotonic() + 10
+	while not any(client.chanid for client in server.clients):
+		if time.monotonic() > deadline:
+			raise TimeoutError("The bot didn't join its channel")
+		time.sleep(0.01)
+	bot_client = next(client for client in server.clients if client.chanid)
+
+	def ask(userid):
+		with replied:
+			sent[userid] = time.monotonic()
+		server.deliver(f"what is the answer to question {userid}?", userid, client=bot_client)
+
+	# one at a time, the bot's own overhead on top of the completion
+	for i in range(count):
+		userid = i % server.users + 1
+		ask(userid)
+		with replied:
+			replied.wait_for(lambda: userid not in sent, 30)
+	sequential = percentiles(latencies)
+	# all at once, from different users, so they queue for the completion workers
+	latencies.clear()
+	started = time.monotonic()
+	for i in range(count):
+		ask(i % server.users + 1)
+	with replied:
+		replied.wait_for(lambda: not sent, 60)
+	burst_seconds = time.monotonic() - started
+	burst = percentiles(latencies)
+	server.on_line = None
+	# every streamed reply should have gone over a reused connection, a low count here means they're being thrown away
+	connections = bot.backend.backend.pool.stats()
+	completions.stop()
+	bot.servers[bot.server_name(entry)].disconnect()
+	bot.store.close()
+	return {
+		"completion_latency_ms": completion_latency * 1000,
+		"send_rate": send_rate,
+		"sequential": sequential,
+		"burst": dict(burst, seconds=round(burst_seconds, 4)),
+		"connections": {"created": connections["created"], "reused": connections["reused"]},
+	}
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark the TeamTalk client and bot against local fake servers")
+	parser.add_argument("--users", type=int, default=1000, help="users in the login flood")
+	parser.add_argument("--channels", type=int, default=100, help="channels in the login flood")
+	parser.add_argument("--repeat", type=int, default=5, help="how many times to connect and log in")
+	parser.add_argument("--messages", type=int, default=20000, help="messages to send for the throughput test")
+	parser.add_argument("--number", type=int, default=20000, help="iterations for parse and lookup timings")
+	parser.add_argument("--replies", type=int, default=50, help="messages for the bot to answer, one at a time and then all at once")
+	parser.add_argument("--completion-latency", type=float, default=0.05, help="seconds the fake completion server takes to answer")
+	parser.add_argument("--send-rate", type=float, default=None, help="lines per second the bot may send, unlimited by default")
+	parser.add_argument("--skip-bot", action="store_true", help="don't benchmark the bot (which needs its requirements installed)")
+	parser.add_argument("--output", help="write the results here instead of printing them")
+	args = parser.parse_args(argv)
+	server = FakeTeamTalkServer(users=args.users, channels=args.channels).start()
+	results = {
+		"meta": {
+			"time": time.time(),
+			"python": platform.python_version(),
+			"implementation": platform.python_implementation(),
+			"platform": platform.platform(),
+		},
+		"connect_login": bench_connect_login(server, args.repeat),
+		"throughput": bench_throughput(server, args.messages),
+	}
+	results["parse"], state = bench_parse(server, args.number)
+	results["lookups"] = bench_lookups(state, args.number)
+	results["dispatch"] = bench_dispatch(args.number)
+	if not args.skip_bot:
+		results["bot"] = bench_bot(server, args.replies, args.completion_latency, args.send_rate)
+	server.stop()
+	output = json.dumps(results, indent="\t")
+	if args.output:
+		with open(args.output, "w") as f:
+			f.write(output + "\n")
+	else:
+		print(output)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -1,97 +1,299 @@
-from multiprocessing.dummy import Pool
 import sys
+import math
+import time
 import json
 import hashlib
-
-from revChatGPT.Official import Chatbot
-import openai
+import functools
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import teamtalk
+import ttgpt
+
+def split_string(string, limit=500):
+	"""Splits string into messages of at most limit bytes, see ttgpt.split_text"""
+	return ttgpt.split_text(string, limit)
+
+def message_limit(server_entry):
+	"""Returns the most bytes a single message may take on the server described by server_entry"""
+	return server_entry.get("message_limit", 500)
+
+def get_server_entries(server_info):
+	"""Returns the settings for every server we should connect to.
+	server_info either describes a single server, or has a "servers" list.
+	Each entry in the list inherits anything it doesn't set itself (E.G. nickname) from the top level."""
+	if "servers" not in server_info:
+		return [server_info]
+	defaults = {key: value for key, value in server_info.items() if key != "servers"}
+	return [dict(defaults, **entry) for entry in server_info["servers"]]
 
-def split_string(string):
-    chunks = []
-    while len(string) > 500:
-        end = string[:500].rfind(".")
-        if end == -1:
-            end = 500
-        chunks.append(string[:end+1])
-        string = string[end+1:]
-    chunks.append(string)
-    return chunks
+def get_backend_options(server_info):
+	"""Returns the list of completion backends to use, in order of preference.
+	Defaults to the OpenAI API (or openai_api_base, E.G. a local stand-in for testing)"""
+	backends = server_info.get("backends")
+	if backends is None:
+		backends = [{"type": "openai", "api_base": server_info.get("openai_api_base")}]
+	return backends
 
 def validate_server_info(server_info):
-	if "host" not in server_info:
-		raise ValueError("No host specified in server_info.json")
-	if "port" not in server_info:
-		raise ValueError("No port specified in server_info.json")
-	if "nickname" not in server_info:
-		raise ValueError("No nickname specified in server_info.json")
-	if "username" not in server_info:
-		raise ValueError("No username specified in server_info.json")
-	if "password" not in server_info:
-		raise ValueError("No password specified in server_info.json")
-	if "channel_id" not in server_info:
-		raise ValueError("No channel specified in server_info.json")
-	if "openai_api_key" not in server_info:
-		raise ValueError("No openai_api_key specified in server_info.json")
-
-t = teamtalk.TeamTalkServer()
+	for options in get_backend_options(server_info):
+		if options.get("type", "openai") == "openai" and "api_key" not in options and "openai_api_key" not in server_info:
+			raise ValueError("No openai_api_key specified in server_info.json")
+		if options.get("type") == "http" and "url" not in options:
+			raise ValueError("No url specified for http backend in server_info.json")
+	for server_entry in get_server_entries(server_info):
+		if "host" not in server_entry:
+			raise ValueError("No host specified in server_info.json")
+		if "port" not in server_entry:
+			raise ValueError("No port specified in server_info.json")
+		if "nickname" not in server_entry:
+			raise ValueError("No nickname specified in server_info.json")
+		if "username" not in server_entry:
+			raise ValueError("No username specified in server_info.json")
+		if "password" not in server_entry:
+			raise ValueError("No password specified in server_info.json")
+		if "channel_id" not in server_entry:
+			raise ValueError("No channel specified in server_info.json")
+
 server_info = None
-chatbot = None
+store = None
+cache = None
+# sent along with every completion request, max_tokens is worked out for each prompt
+# the stop sequence keeps the model from writing the user's next message itself
+completion_params = {"model": "text-davinci-003", "temperature": 1.2, "stop": ["\nUser:"]}
+backend = None
+counter = None
+context_builder = None
+pool = None
+dispatch_pool = None
+scheduler = None
+limiter = None
+trace_log = None
+# server_name(server_entry) -> TeamTalkServer, for collect_stats
+servers = {}
+
+# served over HTTP when "metrics" is configured, see collect_stats for the rest
+metrics = ttgpt.MetricsRegistry()
+completion_seconds = metrics.histogram("ttgpt_completion_seconds", "Time the completion backend took to answer", ("mode",))
+first_chunk_seconds = metrics.histogram("ttgpt_first_chunk_seconds", "Time from starting a streamed completion to sending its first message")
+completion_wait_seconds = metrics.histogram("ttgpt_completion_wait_seconds", "Time requests waited for a completion worker")
+reply_seconds = metrics.histogram("ttgpt_reply_seconds", "Time from receiving a message to finishing the reply", ("source",))
+reply_chunks = metrics.histogram("ttgpt_reply_chunks", "Messages sent per reply", buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32))
+requests_handled = metrics.counter("ttgpt_requests_total", "Requests handled, by outcome", ("outcome",))
 
-def handle_commands(content):
+def handle_commands(content, conversation_id):
 	if content[0] == "reset":
-		chatbot.reset()
+		store.reset(conversation_id)
 		return "Conversation reset."
 	if content[0] == "rollback" and len(content) == 2:
 		try:
-			chatbot.rollback(int(content[1]))
-			return f"Rolled back {content[1]} messages."
+			count = int(content[1])
 		except ValueError:
 			return "Invalid number of messages to rollback."
-		except IndexError:
+		if count < 0:
+			return "Invalid number of messages to rollback."
+		if store.rollback(conversation_id, count) < count:
 			return "Rolled back to the start of the conversation."
+		return f"Rolled back {content[1]} messages."
 	if content[0] == "help":
 		return "Available commands:\nreset - Resets the conversation.\nrollback x - Rolls the conversation back by x messages.\nhelp - Shows this message."
 	else:
 		return ""
 
-def _make_gpt_request(original_content, conversation_id):
+def clean_reply(message):
+	"""Removes all blank lines from message"""
+	return "\n".join([line for line in message.split("\n") if line.strip() != ""])
+
+
+def send_chunk(reply, chunk):
+	"""Sends a single message through reply, which is a function taking the text to send.
+	Returns True if a message was sent"""
+	chunk = clean_reply(chunk)
+	if not chunk:
+		return False
+	try:
+		reply(chunk)
+	except teamtalk.TeamTalkError as e:
+		print(chunk)
+		print(e)
+		return False
+	return True
+
+
+def send_reply(reply, text, limit=500):
+	"""Sends text through reply, split into messages of at most limit bytes at the nearest paragraph, sentence or word boundary.
+	Returns how many messages were sent"""
+	sent = 0
+	for chunk in split_string(text, limit):
+		if send_chunk(reply, chunk):
+			sent += 1
+	return sent
+
+
+def add_to_history(conversation_id, original_content, message):
+	"""Records an answer in the conversation's history"""
+	tokens = counter.count(ttgpt.format_exchange(original_content, message))
+	store.add(conversation_id, original_content, message, tokens)
+
+def remember(conversation_id, original_content, message, prompt):
+	"""Records a completed answer in the conversation's history and the cache"""
+	add_to_history(conversation_id, original_content, message)
+	if cache:
+		cache.put(ttgpt.cache_key(original_content, completion_params, prompt.context), message)
+
+def _make_gpt_request(original_content, conversation_id, prompt, submitted):
+	completion_wait_seconds.observe(time.monotonic() - submitted)
 	try:
-		response = openai.Completion.create(engine="text-davinci-003", prompt=original_content, max_tokens=2000, temperature=1.2)
-		message = response["choices"][0]["text"]
+		with completion_seconds.time(mode="complete"):
+			message = backend.complete(prompt.text, **dict(completion_params, max_tokens=prompt.max_tokens))
+	except ttgpt.CircuitOpenError:
+		requests_handled.inc(outcome="unavailable")
+		return "I'm having trouble reaching my brain right now, please try again in a little while."
 	except Exception as e:
-		message = f"Error: {str(e)}"
+		requests_handled.inc(outcome="error")
+		return f"Error: {str(e)}"
+	requests_handled.inc(outcome="completed")
 	# if result is empty or just a newline, return
 	if message .strip() == "" or message .strip() == "":
-		message  = "I don't know what to say."
+		return "I don't know what to say."
 	# remove all blank lines
-	message  = "\n".join([line for line in message .split("\n") if line.strip() != ""])
+	message  = clean_reply(message)
+	remember(conversation_id, original_content, message, prompt)
 	return message
 
-def make_gpt_request(original_content, conversation_id):
-	with  Pool(None) as p:
-		result = p.apply_async(_make_gpt_request, (original_content, conversation_id))
-		while not result.ready():
-			pass
-	return result.get()
+def _stream_gpt_request(original_content, conversation_id, prompt, reply, limit, submitted):
+	"""Like _make_gpt_request, but sends the answer through reply while it is still being generated, in messages of at most limit bytes"""
+	completion_wait_seconds.observe(time.monotonic() - submitted)
+	started = time.monotonic()
+	chunker = ttgpt.StreamChunker(limit)
+	parts = []
+	sent = 0
+	try:
+		for text in backend.stream(prompt.text, **dict(completion_params, max_tokens=prompt.max_tokens)):
+			parts.append(text)
+			for chunk in chunker.feed(text):
+				if send_chunk(reply, chunk):
+					if not sent:
+						first_chunk_seconds.observe(time.monotonic() - started)
+					sent += 1
+	except ttgpt.CircuitOpenError:
+		requests_handled.inc(outcome="unavailable")
+		send_chunk(reply, "I'm having trouble reaching my brain right now, please try again in a little while.")
+		return
+	except Exception as e:
+		requests_handled.inc(outcome="error")
+		send_chunk(reply, f"Error: {str(e)}")
+		return
+	for chunk in chunker.flush():
+		if send_chunk(reply, chunk):
+			if not sent:
+				first_chunk_seconds.observe(time.monotonic() - started)
+			sent += 1
+	completion_seconds.observe(time.monotonic() - started, mode="stream")
+	requests_handled.inc(outcome="completed")
+	reply_chunks.observe(sent)
+	message = clean_reply("".join(parts))
+	if message.strip() == "":
+		send_chunk(reply, "I don't know what to say.")
+		return
+	remember(conversation_id, original_content, message, prompt)
+
+def admit(server_entry, params, reply):
+	"""Checks the request in params against the rate limiter, telling the user if it was refused.
+	Private messages take priority over channel mentions.
+	Returns True if the request may go ahead"""
+	if not limiter:
+		return True
+	# ids are only unique within a server
+	server = (server_entry["host"], server_entry["port"])
+	user = server + (params["srcuserid"],)
+	if params["type"] == teamtalk.CHANNEL_MSG:
+		wait = limiter.acquire(user, server + (params["chanid"],), timeout=server_entry.get("rate_limit_wait", 0))
+	else:
+		wait = limiter.acquire(user, priority=True, timeout=server_entry.get("rate_limit_wait", 0))
+	if wait == 0:
+		return True
+	limit = message_limit(server_entry)
+	if wait == float("inf"):
+		send_reply(reply, "I'm not able to answer requests right now.", limit)
+	else:
+		send_reply(reply, f"Too many requests, please try again in {math.ceil(wait)} seconds.", limit)
+	return False
 
 
-def handle_channel_message(original_content, content, conversation_id):
-	cmd_result = handle_commands(content[0:])
+def make_gpt_request(server_entry, original_content, conversation_id, reply, params, received):
+	"""Answers original_content, received being the time.monotonic() the message arrived at"""
+	# as much of the conversation as fits in the model's context goes along with the new message
+	prompt = context_builder.build(store.get(conversation_id), original_content)
+	limit = message_limit(server_entry)
+	if cache:
+		cached = cache.get(ttgpt.cache_key(original_content, completion_params, prompt.context))
+		if cached:
+			# it's in the cache already, putting it back would only push its expiry out
+			add_to_history(conversation_id, original_content, cached)
+			reply_chunks.observe(send_reply(reply, cached, limit))
+			requests_handled.inc(outcome="cached")
+			reply_seconds.observe(time.monotonic() - received, source="cache")
+			return
+	# cached answers are free, only limit the ones that cost a completion
+	if not admit(server_entry, params, reply):
+		requests_handled.inc(outcome="rate_limited")
+		return
+	try:
+		if server_entry.get("stream"):
+			future = pool.submit(_stream_gpt_request, original_content, conversation_id, prompt, reply, limit, time.monotonic())
+		else:
+			future = pool.submit(_make_gpt_request, original_content, conversation_id, prompt, time.monotonic())
+	except ttgpt.PoolFullError:
+		requests_handled.inc(outcome="busy")
+		send_reply(reply, "Too many people are waiting for a reply right now, please try again shortly.", limit)
+		return
+	result = future.result()
+	# streamed replies have already been sent
+	if result:
+		reply_chunks.observe(send_reply(reply, result, limit))
+	reply_seconds.observe(time.monotonic() - received, source="completion")
+
+
+def handle_channel_message(server_entry, original_content, content, conversation_id, reply, params, received):
+	cmd_result = handle_commands(content[0:], conversation_id)
 	if cmd_result != "":
-		return cmd_result
+		send_reply(reply, cmd_result, message_limit(server_entry))
 	else:
-		return make_gpt_request(original_content, conversation_id)
+		make_gpt_request(server_entry, original_content, conversation_id, reply, params, received)
+
+
+def schedule(server_entry, conversation_id, original_content, job, reply):
+	"""Queues job behind anything else happening in the conversation.
+	A repeat of a prompt that is already being answered is merged into it, and the user is told if they have too many requests waiting."""
+	status = scheduler.submit(conversation_id, job, key=ttgpt.normalize_prompt(original_content))
+	if status == ttgpt.REJECTED:
+		requests_handled.inc(outcome="rejected")
+		send_reply(reply, "I'm still working on your earlier messages, please wait for those to be answered first.", message_limit(server_entry))
 
 
-@t.subscribe("messagedeliver")
-def message(server, params):
+def get_conversation_id(server_entry, params):
+	"""Returns the conversation a messagedeliver event belongs to, or None if it isn't one we answer.
+	Channel messages share a conversation per channel, private messages get one per user."""
+	# ids are only unique within a server
+	server = str(server_entry["host"])+":"+str(server_entry["port"])
+	# channel and user ids can be the same number, keep their conversations apart
+	if params["type"] == teamtalk.CHANNEL_MSG:
+		conversation_id = server+":chan:"+str(params["chanid"])
+	elif params["type"] == teamtalk.USER_MSG:
+		conversation_id = server+":user:"+str(params["srcuserid"])
+	else:
+		return None
+	return hashlib.sha256(conversation_id.encode()).hexdigest()
+
+
+def message(server_entry, server, params):
+	received = time.monotonic()
 	if params["srcuserid"] == server.me["userid"]:
 		return
+	conversation_id = get_conversation_id(server_entry, params)
 	if params["type"] == teamtalk.CHANNEL_MSG:
-		conversation_id = str(server_info["host"])+":"+str(params["chanid"])
-		conversation_id = hashlib.sha256(conversation_id.encode()).hexdigest()
 		original_content = params["content"].strip().split(" ")
 		original_content = original_content[1:]
 		original_content = " ".join(original_content)
@@ -101,47 +303,52 @@ def message(server, params):
 			return
 		if content[0] != "@gpt":
 			return ""
-		result = handle_channel_message(original_content, content[1:], conversation_id)
-		if not result:
-			return
-		# split the string into chunks of 500 characters at the nearest full stop
-		message  = split_string(result)
-		for chunk in message :
-			try:
-				server.channel_message(chunk)
-			except teamtalk.TeamTalkError as e:
-				print(chunk)
-				print(e)
-		chatbot.save_conversation(conversation_id)
-		chatbot.conversations.save("conversations.json")
+		reply = server.channel_message
+		job = functools.partial(handle_channel_message, server_entry, original_content, content[1:], conversation_id, reply, params, received)
+		schedule(server_entry, conversation_id, original_content, job, reply)
 	if params["type"] == teamtalk.USER_MSG:
-		conversation_id = str(server_info["host"])+":"+str(params["srcuserid"])
-		conversation_id = hashlib.sha256(conversation_id.encode()).hexdigest()
 		original_content = params["content"].strip()
 		content = params["content"].strip().lower().split(" ")
 		# make sure that content it ast least 1 long
 		if len(content) < 1:
 			return
-		result = handle_channel_message(original_content, content, conversation_id)
-		if not result:
-			return
-		# split the string into chunks of 500 characters at the nearest full stop
-		message  = split_string(result)
-		for chunk in message :
-			try:
-				server.user_message(params["srcuserid"], chunk)
-			except teamtalk.TeamTalkError as e:
-				print(chunk)
-				print(e)
-		chatbot.save_conversation(conversation_id)
-		chatbot.conversations.save("conversations.json")
+		reply = functools.partial(server.user_message, params["srcuserid"])
+		job = functools.partial(handle_channel_message, server_entry, original_content, content, conversation_id, reply, params, received)
+		schedule(server_entry, conversation_id, original_content, job, reply)
 
-def main(server_info):
-	t.set_connection_info(server_info["host"], server_info["port"])
+
+def server_name(server_entry):
+	"""Names a config entry's connection in metrics.
+	Several entries can share a server (with different nicknames or channels), so host and port alone aren't enough"""
+	return f"{server_entry['host']}:{server_entry['port']}:{server_entry['nickname']}:{server_entry['channel_id']}"
+
+
+def run_server(server_entry):
+	"""Connects to a single server and answers messages there until the connection ends"""
+	# message only queues work with the scheduler, which answers on the dispatch pool
+	# so the reader loop keeps draining the socket, and each conversation is still answered in order
+	# replies are paced to stay under the server's command flood limit
+	# if the connection drops, it is re-established (and the channel rejoined) without losing queued replies
+	t = teamtalk.TeamTalkServer(
+		server_entry["host"],
+		server_entry["port"],
+		server_entry.get("send_rate", 5),
+		server_entry.get("send_burst", 10),
+		reconnect=True,
+		reconnect_max_delay=server_entry.get("reconnect_max_delay", 30.0),
+	)
+	t.trace = trace_log
+	servers[server_name(server_entry)] = t
+	# broadcasts and our own messages are dropped before they're parsed
+	t.subscribe("messagedeliver", functools.partial(message, server_entry), where={
+		"type": lambda type: type in (teamtalk.USER_MSG, teamtalk.CHANNEL_MSG),
+		"srcuserid": lambda userid: userid != t.me.get("userid"),
+	})
+	t.subscribe("reconnected", lambda server, params: print(f"Reconnected to {server.host}:{server.tcpport} after {params['downtime']:.1f} seconds"))
 	t.connect()
-	t.login(server_info["nickname"], server_info["username"], server_info["password"], "TTGPTClient")
-	t.join(t.get_channel(server_info["channel_id"]))
-	while True:
+	t.login(server_entry["nickname"], server_entry["username"], server_entry["password"], "TTGPTClient")
+	t.join(t.get_channel(server_entry["channel_id"]))
+	while not t.disconnecting:
 		try:
 			t.handle_messages(2)
 		except teamtalk.TeamTalkError as e:
@@ -149,14 +356,104 @@ def main(server_info):
 			print(e.message)
 
 
+def collect_stats():
+	"""Reads the numbers kept by the workers, scheduler, store, cache and connections, for the metrics endpoint"""
+	queue_depth = ttgpt.Gauge("ttgpt_queue_depth", "Work waiting to start", ("queue",))
+	queue_depth.set(pool.queue_depth, queue="completion")
+	queue_depth.set(scheduler.stats()["pending"], queue="conversation")
+	in_flight = ttgpt.Gauge("ttgpt_completions_in_flight", "Completions currently being generated")
+	in_flight.set(pool.in_flight)
+	store_stats = store.stats()
+	flushes = ttgpt.Counter("ttgpt_store_flushes_total", "Times conversation history was written to disk")
+	flushes.inc(store_stats["flushes"])
+	flush_seconds = ttgpt.Counter("ttgpt_store_flush_seconds_total", "Time spent writing conversation history to disk")
+	flush_seconds.inc(store_stats["flush_time"])
+	last_flush = ttgpt.Gauge("ttgpt_store_last_flush_seconds", "How long the last write of conversation history took")
+	last_flush.set(store_stats["last_flush_time"])
+	collected = [queue_depth, in_flight, flushes, flush_seconds, last_flush]
+	if cache:
+		cache_stats = cache.stats()
+		lookups = ttgpt.Counter("ttgpt_cache_lookups_total", "Response cache lookups, by result", ("result",))
+		lookups.inc(cache_stats["hits"] - cache_stats["disk_hits"], result="memory_hit")
+		lookups.inc(cache_stats["disk_hits"], result="disk_hit")
+		lookups.inc(cache_stats["misses"], result="miss")
+		collected.append(lookups)
+	lines = ttgpt.Counter("teamtalk_lines_received_total", "Lines read from the server", ("server",))
+	parse_seconds = ttgpt.Counter("teamtalk_parse_seconds_total", "Time spent parsing lines from the server", ("server",))
+	events = ttgpt.Counter("teamtalk_events_total", "Events received, by type", ("server", "event"))
+	callback_seconds = ttgpt.Counter("teamtalk_callback_seconds_total", "Time spent in event subscribers on the reader thread", ("server", "event"))
+	lines_sent = ttgpt.Counter("teamtalk_lines_sent_total", "Lines written to the server", ("server",))
+	outbound = ttgpt.Gauge("teamtalk_outbound_queue_depth", "Lines waiting to be written to the server", ("server",))
+	ping = ttgpt.Gauge("teamtalk_ping_rtt_seconds", "Round trip time of the last answered ping", ("server",))
+	reconnects = ttgpt.Counter("teamtalk_reconnects_total", "Times the connection was re-established", ("server",))
+	for name, server in list(servers.items()):
+		stats = server.stats()
+		lines.inc(stats["lines_received"], server=name)
+		parse_seconds.inc(stats["parse_time"], server=name)
+		for event, event_stats in stats["events"].items():
+			events.inc(event_stats["count"], server=name, event=event)
+			callback_seconds.inc(event_stats["time"], server=name, event=event)
+		lines_sent.inc(stats["writer"]["lines_sent"], server=name)
+		outbound.set(stats["writer"]["queue_depth"], server=name)
+		if stats["ping_rtt"] is not None:
+			ping.set(stats["ping_rtt"], server=name)
+		reconnects.inc(stats["reconnects"], server=name)
+	return collected + [lines, parse_seconds, events, callback_seconds, lines_sent, outbound, ping, reconnects]
+
+
+def _run_server(server_entry):
+	try:
+		run_server(server_entry)
+	except Exception:
+		# one server failing shouldn't take the others down with it
+		print(f"Connection to {server_entry['host']}:{server_entry['port']} failed")
+		traceback.print_exc()
+
+
+def main(server_info):
+	# every connection shares the same workers, cache, rate limiter and conversation store
+	threads = []
+	for server_entry in get_server_entries(server_info):
+		thread = threading.Thread(target=_run_server, args=(server_entry,), name=f"server-{server_entry['host']}:{server_entry['port']}")
+		thread.daemon = True
+		thread.start()
+		threads.append(thread)
+	for thread in threads:
+		thread.join()
+
+
 
 if __name__ == "__main__":
 	server_info = json.load(open("config.json"))
 	validate_server_info(server_info)
-	chatbot = Chatbot(server_info["openai_api_key"])
-	openai.api_key = server_info["openai_api_key"]
+	pool = ttgpt.CompletionPool(server_info.get("completion_workers", 4), server_info.get("completion_queue", 32))
+	dispatch_pool = ThreadPoolExecutor(server_info.get("dispatch_workers", 8), thread_name_prefix="dispatch")
+	scheduler = ttgpt.ConversationScheduler(dispatch_pool, server_info.get("max_pending", 3))
+	backend = ttgpt.create_backend(get_backend_options(server_info), server_info.get("openai_api_key"))
+	counter = ttgpt.TokenCounter(completion_params["model"])
+	context_builder = ttgpt.ContextBuilder(
+		counter,
+		server_info.get("context_tokens", 4097),
+		server_info.get("max_tokens", 2000),
+		server_info.get("min_reply_tokens", 256),
+		server_info.get("max_history_tokens"),
+	)
+	# history is only read from disk when a conversation is first used
+	store = ttgpt.ConversationStore(server_info.get("conversations_dir", "conversations"), server_info.get("save_interval", 1.0))
+	if "cache" in server_info:
+		cache = ttgpt.ResponseCache(**server_info["cache"])
+	if "rate_limit" in server_info:
+		limiter = ttgpt.RateLimiter(**server_info["rate_limit"])
+	metrics.add_collector(collect_stats)
+	if "metrics" in server_info:
+		ttgpt.MetricsServer(metrics, **server_info["metrics"]).start()
+	if server_info.get("trace_log"):
+		trace_log = ttgpt.TraceLog(server_info["trace_log"])
 	try:
-		chatbot.conversations.load("conversations.json")
-	except FileNotFoundError:
-			pass
-	main(server_info)
+		main(server_info)
+	finally:
+		store.close()
+		if cache:
+			cache.close()
+		if trace_log:
+			trace_log.close()
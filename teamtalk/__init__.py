@@ -1 +1,6 @@
 from teamtalk.teamtalk import *
+from teamtalk.aio import *
+from teamtalk.state import *
+from teamtalk.records import *
+from teamtalk.writer import *
+from teamtalk.keepalive import *
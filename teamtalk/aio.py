@@ -0,0 +1,156 @@
+"""An asyncio flavoured TeamTalkServer.
+
+Uses asyncio streams instead of telnetlib, so many connections (and the conversations on them) can share one event loop without a thread each.
+"""
+
+
+import asyncio
+import inspect
+
+from teamtalk.teamtalk import TeamTalkServer, parse_tt_message, build_tt_message
+
+
+class AsyncTeamTalkServer(TeamTalkServer):
+	"""Represents a single TeamTalk server, driven by an asyncio event loop.
+	connect, login, handle_messages, join, channel_message and user_message are coroutines.
+	Everything else (get_user, get_channel, the remaining helpers, etc) behaves exactly like TeamTalkServer.
+	Subscribers may be regular functions or coroutine functions, the latter are scheduled as tasks.
+	Once logged in, handle_messages should be running as a task so that awaited commands can complete."""
+
+	def __init__(self, host=None, tcpport=10333):
+		super().__init__(host, tcpport)
+		self.reader = None
+		self.ping_task = None
+
+	async def connect(self):
+		"""Initiates the connection to this server
+		Raises an exception on failure"""
+		self.reader, self.con = await asyncio.open_connection(self.host, self.tcpport)
+		# the first thing we should get is a welcome message
+		welcome = await self.read_line(timeout=3)
+		if not welcome:
+			raise TimeoutError("Server failed to send welcome message in time")
+		welcome = welcome.decode()
+		event, params = parse_tt_message(welcome)
+		if event != "teamtalk":
+			# could mean we're working with a TT 4 server, or different protocol entirely
+			return
+		self.server_params = params
+		self._update_ping_interval()
+
+	async def login(self, nickname, username, password, client, protocol="5.6", version="1.0", callback=None):
+		"""Attempts to log in to the server.
+		This should be awaited immediately after connect to prevent timing out.
+		Returns once the login sequence has completed, raising TeamTalkError if the server refused us.
+		If callback is specified, it behaves the same as handle_messages for the duration of this sequence."""
+		future = self._expect(1, "login")
+		message = build_tt_message(
+			"login",
+			{
+				"nickname": nickname,
+				"username": username,
+				"password": password,
+				"clientname": client,
+				"protocol": protocol,
+				"version": version,
+				"id": 1,
+			},
+		)
+		self.send(message)
+		self.start_threads()
+		self._login_sequence = 1
+		await self.handle_messages(callback=callback)
+		return await future
+
+	def start_threads(self):
+		"""Starts the keepalive task. Despite the name, no threads are involved"""
+		self.ping_task = asyncio.get_running_loop().create_task(self.handle_pings())
+
+	async def handle_pings(self):
+		"""Pings the server at a reasonable interval until we disconnect"""
+		while not self.disconnecting:
+			self.send("ping")
+			await asyncio.sleep(self._ping_interval())
+
+	async def read_line(self, timeout=None):
+		"""Reads and returns a line from the server.
+		Returns b"" if nothing arrived within timeout seconds"""
+		if self.disconnecting:
+			return False
+		try:
+			return await asyncio.wait_for(self.reader.readuntil(b"\r\n"), timeout)
+		except asyncio.TimeoutError:
+			return b""
+		except asyncio.IncompleteReadError as e:
+			# the server closed the connection
+			self.disconnect()
+			return e.partial
+
+	def send(self, line):
+		"""Sends a line to the server.
+		Writes straight to the stream, which already buffers, rather than going through the threaded writer"""
+		if self.disconnecting:
+			return False
+		self.con.write(self._encode_line(line))
+
+	async def drain(self):
+		"""Waits until everything sent so far has been handed to the operating system"""
+		await self.con.drain()
+
+	def disconnect(self):
+		"""Disconnect from this server.
+		Stops the keepalive task and fails any commands still waiting on a response"""
+		if self.disconnecting:
+			return
+		super().disconnect()
+		if self.ping_task:
+			self.ping_task.cancel()
+
+	async def handle_messages(self, timeout=1, callback=None):
+		"""Processes all incoming messages until we disconnect (or the login sequence completes, when logging in)
+		Behaves like TeamTalkServer.handle_messages, except callback may also be a coroutine function"""
+		while not self.disconnecting:
+			if self._login_sequence == 2:
+				self._login_sequence = 0
+				break
+			line = await self.read_line(timeout)
+			if line is False:
+				break
+			result = self._process_line(line, callable(callback))
+			if result and callable(callback):
+				await self._maybe_await(callback(self, *result))
+
+	def _dispatch(self, event, params):
+		for func in self.subscriptions.get(event, []):
+			result = func(self, params)
+			if inspect.isawaitable(result):
+				asyncio.ensure_future(result)
+
+	async def _maybe_await(self, result):
+		if inspect.isawaitable(result):
+			await result
+
+	def _new_future(self):
+		return asyncio.get_running_loop().create_future()
+
+	async def command(self, helper, *args, **kwargs):
+		"""Calls one of the regular helpers (kick, move, change_status, etc) with a fresh id and waits for the server to respond.
+		Returns the list of (event, parameters) tuples sent as part of the response.
+		Raises TeamTalkError if the server rejected the command."""
+		return await super().command(helper, *args, **kwargs)
+
+	async def join(self, channel, password="", id=None):
+		"""Joins the specified channel, optionally with a password.
+		channel can be anything accepted by get_channel
+		Returns the events sent in response, raises TeamTalkError on failure"""
+		return await self.command(super().join, channel, password)
+
+	async def channel_message(self, content, to=None, id=None):
+		"""Sends a channel message and waits for the server to accept it.
+		To can be None (current channel) or anything accepted by get_channel"""
+		return await self.command(super().channel_message, content, to)
+
+	async def user_message(self, to, content, id=None):
+		"""Sends a private message to a user on this server and waits for the server to accept it.
+		To is the recipient, and can be anything accepted by get_user"""
+		return await self.command(super().user_message, to, content)
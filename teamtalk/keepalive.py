@@ -0,0 +1,80 @@
+"""Keeping TeamTalk connections alive from a single thread."""
+
+
+import time
+import heapq
+import itertools
+import threading
+import traceback
+
+
+class KeepaliveScheduler:
+	"""Pings any number of TeamTalkServer connections from one thread.
+	The thread sleeps on a condition until the next connection is due, instead of polling.
+	Connections decide for themselves whether a ping is needed (see TeamTalkServer._keepalive)."""
+
+	def __init__(self):
+		self._condition = threading.Condition()
+		# (due, sequence, server) tuples, the sequence breaks ties without comparing servers
+		self._heap = []
+		self._sequence = itertools.count()
+		# server -> the due time of its live heap entry, anything else in the heap is stale
+		self._due = {}
+		self._thread = None
+
+	def add(self, server, delay=0):
+		"""Starts keeping server alive, checking it for the first time after delay seconds"""
+		with self._condition:
+			self._schedule(server, time.monotonic() + delay)
+			if not self._thread or not self._thread.is_alive():
+				self._thread = threading.Thread(target=self._run, name="teamtalk-keepalive")
+				self._thread.daemon = True
+				self._thread.start()
+
+	def remove(self, server):
+		"""Stops keeping server alive"""
+		with self._condition:
+			self._due.pop(server, None)
+			self._condition.notify()
+
+	def __contains__(self, server):
+		return server in self._due
+
+	def __len__(self):
+		return len(self._due)
+
+	def _schedule(self, server, due):
+		self._due[server] = due
+		heapq.heappush(self._heap, (due, next(self._sequence), server))
+		self._condition.notify()
+
+	def _run(self):
+		while True:
+			with self._condition:
+				while True:
+					if self._heap:
+						due, seq, server = self._heap[0]
+						if self._due.get(server) != due:
+							# removed or rescheduled since
+							heapq.heappop(self._heap)
+							continue
+						delay = due - time.monotonic()
+						if delay <= 0:
+							heapq.heappop(self._heap)
+							break
+						self._condition.wait(delay)
+					else:
+						self._condition.wait()
+			try:
+				delay = server._keepalive()
+			except Exception:
+				traceback.print_exc()
+				delay = 1.0
+			with self._condition:
+				# unless it was removed while we were pinging it
+				if self._due.get(server) == due:
+					self._schedule(server, time.monotonic() + delay)
+
+
+# shared by every TeamTalkServer that isn't given its own scheduler
+default_keepalive = KeepaliveScheduler()
@@ -0,0 +1,129 @@
+"""Compact records for the users, channels and files a TeamTalkServer knows about.
+
+A server with thousands of users keeps thousands of these around, so each is a __slots__ object rather than a dict holding its own copy of every field name.
+Records still behave like the dicts they replace (record["nickname"], .get, in, iteration, ==), and to_dict() returns a real one.
+"""
+
+
+import sys
+from collections.abc import MutableMapping
+
+
+# list values that are usually identical between records (E.G. every channel using the same codec), shared rather than copied
+_shared_values = {}
+
+
+class Record(MutableMapping):
+	"""Base class for records.
+	fields lists the parameters given a slot, anything else the server sends is kept in a dict on the side.
+	List values are stored as tuples and handed out as lists again when read through the dict interface.
+	Fields in shared have their tuples deduplicated between records, and strings in interned are interned."""
+
+	__slots__ = ("_extra",)
+	fields = ()
+	shared = frozenset()
+	interned = frozenset()
+
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		cls._field_set = frozenset(cls.fields)
+
+	def __init__(self, params=None, **kwargs):
+		self._extra = None
+		if params:
+			self.update(params)
+		if kwargs:
+			self.update(kwargs)
+
+	def _pack(self, key, value):
+		if isinstance(value, list):
+			value = tuple(value)
+			if key in self.shared:
+				value = _shared_values.setdefault(value, value)
+		elif isinstance(value, str) and key in self.interned:
+			value = sys.intern(value)
+		return value
+
+	def __getitem__(self, key):
+		if key in self._field_set:
+			try:
+				value = getattr(self, key)
+			except AttributeError:
+				raise KeyError(key) from None
+		elif self._extra is not None and key in self._extra:
+			value = self._extra[key]
+		else:
+			raise KeyError(key)
+		return list(value) if isinstance(value, tuple) else value
+
+	def __setitem__(self, key, value):
+		value = self._pack(key, value)
+		if key in self._field_set:
+			setattr(self, key, value)
+		else:
+			if self._extra is None:
+				self._extra = {}
+			self._extra[key] = value
+
+	def __delitem__(self, key):
+		if key in self._field_set:
+			try:
+				delattr(self, key)
+			except AttributeError:
+				raise KeyError(key) from None
+		elif self._extra is not None and key in self._extra:
+			del self._extra[key]
+		else:
+			raise KeyError(key)
+
+	def __contains__(self, key):
+		if key in self._field_set:
+			return hasattr(self, key)
+		return self._extra is not None and key in self._extra
+
+	def __iter__(self):
+		for field in self.fields:
+			if hasattr(self, field):
+				yield field
+		if self._extra:
+			yield from list(self._extra)
+
+	def __len__(self):
+		return sum(1 for field in self.fields if hasattr(self, field)) + len(self._extra or ())
+
+	def to_dict(self):
+		"""Returns the record as a plain dict"""
+		return {key: self[key] for key in self}
+
+	def __repr__(self):
+		return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class User(Record):
+	"""A user on the server, built from loggedin, adduser and updateuser events"""
+
+	fields = (
+		"userid", "nickname", "username", "chanid", "usertype", "userrights", "statusmode", "statusmsg",
+		"userdata", "ipaddr", "udpaddr", "version", "packetprotocol", "clientname", "sublocal", "subpeer",
+	)
+	__slots__ = fields
+	interned = frozenset(("version", "clientname"))
+
+
+class Channel(Record):
+	"""A channel on the server, built from addchannel and updatechannel events"""
+
+	fields = (
+		"chanid", "parentid", "channel", "name", "topic", "password", "oppassword", "protected", "maxusers",
+		"audiocodec", "audioconfig", "type", "userdata", "diskquota", "operators", "voiceusers", "videousers",
+		"desktopusers", "mediafileusers", "transmitusers", "transmitqueue", "transmitswitchdelay", "totvoice", "totmediafile",
+	)
+	__slots__ = fields
+	shared = frozenset(("audiocodec", "audioconfig"))
+
+
+class File(Record):
+	"""A file in a channel, built from addfile events"""
+
+	fields = ("fileid", "chanid", "filename", "filesize", "owner", "uploadtime")
+	__slots__ = fields
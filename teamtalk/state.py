@@ -0,0 +1,196 @@
+"""Indexed storage for the users, channels and files a TeamTalkServer knows about."""
+
+
+from collections.abc import Mapping, Sequence
+
+
+_MISSING = object()
+
+
+class Table:
+	"""A set of rows (dicts of parameters) keyed by a primary field, with secondary indexes.
+	key is a field name, or a tuple of field names for a composite key.
+	indexes is an iterable of field names (or tuples of field names) that can be looked up with find and find_all.
+	If record is given (E.G. teamtalk.User), rows are stored as instances of it instead of the dicts they were added as.
+	Indexes are kept up to date by add, update, discard_field and remove. Rows shouldn't be modified any other way."""
+
+	def __init__(self, key, indexes=(), record=None):
+		self.key = key
+		self.record = record
+		self.rows = {}
+		# maps fields -> value -> primary key, or {primary key: None} once several rows share the value (dicts are used as ordered sets)
+		# most values (nicknames, file ids) are unique, and a bare key is much smaller than a dict
+		self._indexes = {fields: {} for fields in indexes}
+
+	@staticmethod
+	def _value(row, fields):
+		if isinstance(fields, tuple):
+			return tuple(row.get(field) for field in fields)
+		return row.get(fields)
+
+	def __len__(self):
+		return len(self.rows)
+
+	def __iter__(self):
+		return iter(self.rows.values())
+
+	def __contains__(self, key):
+		return key in self.rows
+
+	def key_of(self, row):
+		"""Returns the primary key of row"""
+		return self._value(row, self.key)
+
+	def get(self, key):
+		"""Returns the row with the given primary key, or None"""
+		return self.rows.get(key)
+
+	def find(self, fields, value):
+		"""Returns the first row whose fields match value, or None"""
+		keys = self._indexes[fields].get(value, _MISSING)
+		if keys is _MISSING:
+			return None
+		if type(keys) is dict:
+			return self.rows[next(iter(keys))]
+		return self.rows[keys]
+
+	def find_all(self, fields, value):
+		"""Returns a list of every row whose fields match value"""
+		keys = self._indexes[fields].get(value, _MISSING)
+		if keys is _MISSING:
+			return []
+		if type(keys) is dict:
+			return [self.rows[key] for key in keys]
+		return [self.rows[keys]]
+
+	def position(self, key):
+		"""Returns the position of the row with the given key in iteration order, or None.
+		Only here for backwards compatibility, this is O(n)"""
+		for i, k in enumerate(self.rows):
+			if k == key:
+				return i
+
+	def _index(self, key, row, indexes):
+		for fields in indexes:
+			index = self._indexes[fields]
+			value = self._value(row, fields)
+			keys = index.get(value, _MISSING)
+			if keys is _MISSING:
+				index[value] = key
+			elif type(keys) is dict:
+				keys[key] = None
+			elif keys != key:
+				index[value] = {keys: None, key: None}
+
+	def _unindex(self, key, row, indexes):
+		for fields in indexes:
+			index = self._indexes[fields]
+			value = self._value(row, fields)
+			keys = index.get(value, _MISSING)
+			if keys is _MISSING:
+				continue
+			if type(keys) is dict:
+				keys.pop(key, None)
+				if len(keys) == 1:
+					index[value] = next(iter(keys))
+			elif keys == key:
+				del index[value]
+
+	def _affected(self, changed):
+		"""Returns the indexes that involve any of the changed fields"""
+		affected = []
+		for fields in self._indexes:
+			if isinstance(fields, tuple):
+				if any(field in changed for field in fields):
+					affected.append(fields)
+			elif fields in changed:
+				affected.append(fields)
+		return affected
+
+	def add(self, row):
+		"""Adds row to the table, or merges it into the existing row with the same key.
+		Returns the stored row"""
+		key = self.key_of(row)
+		if key in self.rows:
+			return self.update(key, row)
+		if self.record is not None and not isinstance(row, self.record):
+			row = self.record(row)
+		self.rows[key] = row
+		self._index(key, row, self._indexes)
+		return row
+
+	def update(self, key, params):
+		"""Merges params into the row with the given key.
+		Returns the updated row, or None if there isn't one"""
+		row = self.rows.get(key)
+		if row is None:
+			return None
+		affected = self._affected(params)
+		self._unindex(key, row, affected)
+		row.update(params)
+		self._index(key, row, affected)
+		return row
+
+	def discard_field(self, key, field):
+		"""Removes field from the row with the given key, if present"""
+		row = self.rows.get(key)
+		if row is None or field not in row:
+			return
+		affected = self._affected((field,))
+		self._unindex(key, row, affected)
+		del row[field]
+		self._index(key, row, affected)
+
+	def remove(self, key):
+		"""Removes and returns the row with the given key, or None"""
+		row = self.rows.pop(key, None)
+		if row is not None:
+			self._unindex(key, row, self._indexes)
+		return row
+
+	def clear(self):
+		"""Removes every row"""
+		self.rows.clear()
+		for index in self._indexes.values():
+			index.clear()
+
+
+class TableView(Sequence):
+	"""A list-like, live view over a Table.
+	Kept so that code written against the old self.users/self.channels/self.files lists keeps working.
+	Positional access is O(n), use the table's lookups where possible."""
+
+	def __init__(self, table):
+		self.table = table
+
+	def __len__(self):
+		return len(self.table)
+
+	def __iter__(self):
+		return iter(self.table)
+
+	def __getitem__(self, index):
+		return list(self.table)[index]
+
+	def __contains__(self, row):
+		if not isinstance(row, Mapping):
+			return False
+		return self.table.get(self.table.key_of(row)) == row
+
+	def __eq__(self, other):
+		if isinstance(other, (list, TableView)):
+			return list(self) == list(other)
+		return NotImplemented
+
+	def __repr__(self):
+		return repr(list(self))
+
+	def append(self, row):
+		"""Adds row to the underlying table"""
+		self.table.add(row)
+
+	def remove(self, row):
+		"""Removes row from the underlying table, raising ValueError if it isn't there"""
+		if row not in self:
+			raise ValueError("row not in table")
+		self.table.remove(self.table.key_of(row))
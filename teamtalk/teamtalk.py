@@ -8,12 +8,27 @@ http://github.com/cartertemm/pyteamtalk
 """
 
 
-import shlex
+import re
 import time
+import shlex
+import random
 import threading
-import telnetlib
 import warnings
 import functools
+import traceback
+import collections
+import concurrent.futures
+from collections.abc import Mapping
+
+from teamtalk.state import Table, TableView
+from teamtalk.records import User, Channel, File
+from teamtalk.writer import OutboundWriter
+from teamtalk.keepalive import default_keepalive
+try:
+	import telnetlib
+except ImportError:
+	# removed in Python 3.13, only TeamTalkServer needs it. AsyncTeamTalkServer works without
+	telnetlib = None
 
 
 # constants
@@ -148,89 +163,183 @@ def split_parts(msg):
 	return (msg[:index], msg[index+1:])
 
 
+# a token is a run of anything but spaces, where quoted sections (which may contain escaped quotes) can include spaces
+_TOKEN_RE = re.compile(r'(?:[^ "\\]+|\\.?|"(?:[^"\\]|\\.)*"?)+')
+
+
 def split_quoted(message):
 	"""Like shlex.split, but preserves quotes."""
-	pos = -1
-	inquote = False
-	buffer = ""
-	final = []
-	while pos < len(message)-1:
-		pos += 1
-		token = message[pos]
-		if token == " " and not inquote:
-			final.append(buffer)
-			buffer = ""
-			continue
-		if token == "\"" and message[pos-1] != "\\":
-			inquote = not inquote
-		buffer += token
-	final.append(buffer)
-	return final
-
-
-def parse_tt_message(message):
+	if '"' not in message:
+		# fast path, nothing can contain a space
+		return message.split(" ")
+	return _TOKEN_RE.findall(message)
+
+
+# how special characters are written inside quoted strings, and back
+_UNESCAPES = {"n": "\n", "r": "\r"}
+_ESCAPE_RE = re.compile(r"\\(.)", re.S)
+
+
+def _unescape_match(match):
+	char = match.group(1)
+	return _UNESCAPES.get(char, char)
+
+
+def escape(value):
+	"""Escapes backslashes, quotes and line breaks so value can go inside a quoted string in a TeamTalk message"""
+	# four str.replace calls run at memchr speed, several times faster than a single str.translate pass
+	# backslashes first, so the ones added for everything else aren't doubled
+	return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r")
+
+
+def unescape(value):
+	"""Inverse of escape"""
+	if "\\" not in value:
+		return value
+	return _ESCAPE_RE.sub(_unescape_match, value)
+
+
+def _is_int(v):
+	return v.isdecimal() or v[:1] == "-" and v[1:].isdecimal()
+
+
+def _parse_value(v):
+	"""Converts a raw value from a TeamTalk message into the matching Python type"""
+	if not v:
+		return v
+	first = v[0]
+	# strings
+	if first == '"':
+		if len(v) > 1 and v[-1] == '"':
+			return unescape(v[1:-1])
+		return v
+	# Lists take the form [x,y,z]
+	if first == "[" and v[-1] == "]":
+		v = v[1:-1]
+		# Make sure we aren't dealing with a blank list
+		if not v:
+			return []
+		# I've never once seem values take a form other than int
+		# better to assume it is possible, however
+		return [int(val) if val.isdecimal() else _parse_value(val) for val in v.split(",")]
+	# preserve ints
+	if _is_int(v):
+		return int(v)
+	return v
+
+
+class LazyParams(Mapping):
+	"""The parameters of a TeamTalk message, decoded one at a time as they are read.
+	Keeps the raw line, finds a value only when it's asked for and remembers it afterwards.
+	Behaves like the (read only) dict parse_tt_message would otherwise return, dict(params) makes it a real one."""
+
+	__slots__ = ("_line", "_start", "_quote", "_escapes", "_values", "_raw")
+
+	def __init__(self, line, start=0):
+		"""line is the whole message, start is where its parameters begin (just after the event name)"""
+		self._line = line
+		self._start = start
+		# anything before the first quote can't be inside a quoted value, so can be found with str.find
+		self._quote = line.find('"', start)
+		# after it, a key is outside quotes if an even number of quotes come before it, unless some are escaped
+		self._escapes = "\\" in line
+		self._values = {}
+		# every raw value by key, only built if str.find can't answer a lookup, or to iterate
+		self._raw = None
+
+	def _index(self):
+		if self._raw is None:
+			self._raw = {}
+			for token in split_quoted(self._line[self._start:].strip()):
+				if token:
+					k, sep, v = token.partition("=")
+					self._raw[k] = v
+		return self._raw
+
+	def _find(self, key):
+		"""Returns the raw value of key, raising KeyError if there isn't one"""
+		if self._raw is not None:
+			return self._raw[key]
+		line = self._line
+		needle = " " + key + "="
+		pos = line.find(needle, self._start)
+		while pos != -1 and self._quote != -1 and pos > self._quote:
+			if self._escapes:
+				# counting quotes won't do, tokenize to find out
+				return self._index()[key]
+			if line.count('"', self._quote, pos) % 2 == 0:
+				break
+			# inside a quoted value, keep looking
+			pos = line.find(needle, pos + 1)
+		if pos == -1:
+			raise KeyError(key)
+		pos += len(needle)
+		match = _TOKEN_RE.match(line, pos)
+		return match.group() if match else ""
+
+	def __getitem__(self, key):
+		try:
+			return self._values[key]
+		except KeyError:
+			pass
+		value = self._values[key] = _parse_value(self._find(key))
+		return value
+
+	def __iter__(self):
+		return iter(self._index())
+
+	def __len__(self):
+		return len(self._index())
+
+	def __repr__(self):
+		return repr(dict(self))
+
+
+def parse_tt_message(message, lazy=False):
 	"""Parses a message sent by Teamtalk.
 	Also preserves datatypes.
+	If lazy is True, parameters are a LazyParams, which only decodes the values that are read.
 	Returns a tuple of (event, parameters)"""
+	if lazy:
+		message = message.strip()
+		end = message.find(" ")
+		if end == -1:
+			return message, LazyParams(message, len(message))
+		return message[:end], LazyParams(message, end)
+	tokens = split_quoted(message.strip())
 	params = {}
-	message = message.strip()
-	message = split_quoted(message)
-	event = message[0]
-	message.remove(event)
-	for item in message:
-		k, v = split_parts(item)
-		# Lists take the form [x,y,z]
-		if v.startswith("[") and v.endswith("]"):
-			v = v.strip("[]")
-			# Make sure we aren't dealing with a blank list
-			if v:
-				v = v.split(",")
-				lst = []
-				for val in v:
-					if val.isdigit():
-						lst.append(int(val))
-					# I've never once seem values take a form other than int
-					# better to assume it is possible, however
-					else:
-						lst.append(val)
-				v = lst
-			else:
-				v = []
-		# preserve ints
-		elif v.isdigit():
-			v = int(v)
-		# strings
-		elif v.startswith('"') and v.endswith('"'):
-			v = v[1:-1]
-		params[k] = v
-	return event, params
+	for item in tokens[1:]:
+		k, sep, v = item.partition("=")
+		params[k] = _parse_value(v)
+	return tokens[0], params
+
+
+def _format_value(val):
+	"""Returns val as it's written in a TeamTalk message"""
+	# integers aren't encapsulated in quotes
+	if isinstance(val, int):
+		return str(int(val))
+	# strings always are, even ones made of digits, so they come back as strings
+	if isinstance(val, str):
+		return '"' + escape(val) + '"'
+	# nor are lists
+	if isinstance(val, (list, tuple)):
+		return "[" + ",".join([_format_value(v) for v in val]) + "]"
+	# anything else (None especially) is a mistake that shouldn't reach the server disguised as a string
+	raise TypeError(f"Can't send a {type(val).__name__} value in a TeamTalk message: {val!r}")
 
 
 def build_tt_message(event, params):
 	"""Given an event and dictionary containing parameters, builds a TeamTalk message.
-	Also preserves datatypes.
+	Also preserves datatypes, and escapes strings so they can hold quotes, backslashes and line breaks.
+	Values must be ints, strs or lists of them, anything else raises TypeError.
 	inverse of parse_tt_message"""
-	message = event
-	for key, val in params.items():
-		message += " " + key + "="
-		# integers aren't encapsulated in quotes
-		if isinstance(val, int) or isinstance(val, str) and val.isdigit():
-			message += str(val)
-		# nor are lists
-		elif isinstance(val, list):
-			message += "["
-			for v in val:
-				if isinstance(v, int) or isinstance(v, str) and v.isdigit():
-					message += str(v) + ","
-				else:
-					message += '"' + v + '",'
-			# get rid of the trailing ",", if necessary
-			if len(val) > 0:
-				message = message[:-1]
-			message += "]"
-		else:
-			message += '"' + val + '"'
-	return message
+	return " ".join([event] + [key + "=" + _format_value(val) for key, val in params.items()])
+
+
+def build_tt_line(event, params):
+	"""Like build_tt_message, but returns the message as bytes, terminated and ready to be written to the server"""
+	return (build_tt_message(event, params) + "\r\n").encode()
 
 
 class TeamTalkError(Exception):
@@ -240,32 +349,261 @@ class TeamTalkError(Exception):
 		self.message = message
 
 	def __str__(self):
-		return "[" + self.code + "]: " + self.message
+		return "[" + str(self.code) + "]: " + self.message
+
+
+class ConnectionLost(ConnectionError):
+	"""Raised when the connection to the server drops and it isn't (or couldn't be) re-established"""
+
+
+# events describing the users, channels and files on the server, which we replay as a diff after reconnecting
+_STATE_EVENTS = frozenset((
+	"loggedin", "loggedout", "adduser", "removeuser", "updateuser",
+	"addchannel", "updatechannel", "removechannel", "addfile", "removefile",
+))
+
+
+class _PendingCommand:
+	"""A command sent with an id, waiting for the server's response"""
+
+	__slots__ = ("name", "future", "events", "error", "sent")
+
+	def __init__(self, name, future):
+		self.name = name
+		self.future = future
+		# (event, parameters) tuples received between begin and end
+		self.events = []
+		self.error = None
+		self.sent = time.monotonic()
+
+
+class SerialDispatcher:
+	"""Runs callbacks on an executor while preserving order between callbacks that share a key.
+	The executor can be anything with a submit(func, *args) method, such as concurrent.futures.ThreadPoolExecutor.
+	Callbacks with different keys run concurrently, callbacks with the same key run one after another in the order they were dispatched.
+	A key of None means no ordering is required."""
+
+	def __init__(self, executor):
+		self.executor = executor
+		self._lock = threading.Lock()
+		self._pending = {}
+
+	def dispatch(self, key, func, *args):
+		"""Schedules func(*args) to run after anything already queued under key"""
+		if key is None:
+			self.executor.submit(self._call, func, args)
+			return
+		with self._lock:
+			pending = self._pending.get(key)
+			if pending is not None:
+				# something is already running for this key, it will pick this up when done
+				pending.append((func, args))
+				return
+			self._pending[key] = collections.deque()
+		self.executor.submit(self._drain, key, func, args)
+
+	def _call(self, func, args):
+		try:
+			func(*args)
+		except Exception:
+			traceback.print_exc()
+
+	def _drain(self, key, func, args):
+		while True:
+			self._call(func, args)
+			with self._lock:
+				pending = self._pending[key]
+				if not pending:
+					del self._pending[key]
+					return
+				func, args = pending.popleft()
+
+
+class _DispatchedSubscription:
+	"""Wraps a subscriber so that it runs through a SerialDispatcher instead of on the reader thread"""
+
+	def __init__(self, func, dispatcher, key=None):
+		self.func = func
+		self.dispatcher = dispatcher
+		self.key = key
+
+	def __call__(self, server, params):
+		key = self.key(params) if callable(self.key) else None
+		self.dispatcher.dispatch(key, self.func, server, params)
+
+
+class _FieldFilter:
+	"""Decides whether an event's parameters match a subscription's where argument.
+	where maps parameter names to the value they must have, or to a function taking the value and returning whether it matches."""
+
+	def __init__(self, where):
+		self.where = dict(where)
+		# a value before the first quote of a line can't be inside a quoted string, so it can be found without tokenizing the line
+		self._fields = [
+			(name, expected, re.compile(" " + re.escape(name) + r'=("(?:[^"\\]|\\.)*"|[^ ]*)'))
+			for name, expected in self.where.items()
+		]
+
+	@staticmethod
+	def _test(expected, value):
+		return expected(value) if callable(expected) else value == expected
+
+	def __call__(self, params):
+		for name, expected in self.where.items():
+			if name not in params or not self._test(expected, params[name]):
+				return False
+		return True
+
+	def peek(self, line):
+		"""Checks the raw line, returning True or False, or None if that can't be worked out without parsing it"""
+		quote = line.find('"')
+		for name, expected, pattern in self._fields:
+			match = pattern.search(line)
+			if match is None or quote != -1 and match.start() > quote:
+				if quote == -1:
+					return False
+				# may be after the quote
+				return None
+			if not self._test(expected, _parse_value(match.group(1))):
+				return False
+		return True
+
+
+class _FilteredSubscription:
+	"""Wraps a subscriber so that it's only called for events matching a _FieldFilter"""
+
+	def __init__(self, func, where):
+		self.target = func
+		self.func = getattr(func, "func", func)
+		self.filter = _FieldFilter(where)
+
+	def __call__(self, server, params):
+		if self.filter(params):
+			return self.target(server, params)
+
+
+class _ResumeState:
+	"""Stands in for a TeamTalkServer in its state handlers while it logs back in.
+	me, users, channels and files are fresh ones the new login fills in, everything else is the server's"""
+
+	_own = frozenset(("server", "me", "_users", "_channels", "_files"))
+
+	def __init__(self, server):
+		object.__setattr__(self, "server", server)
+		object.__setattr__(self, "me", {})
+		users, channels, files = server._new_tables()
+		object.__setattr__(self, "_users", users)
+		object.__setattr__(self, "_channels", channels)
+		object.__setattr__(self, "_files", files)
+
+	def __getattr__(self, name):
+		return getattr(self.server, name)
+
+	def __setattr__(self, name, value):
+		if name in self._own:
+			object.__setattr__(self, name, value)
+		else:
+			setattr(self.server, name, value)
+
+
+# events that are always parsed, even if nobody subscribes, because the reader loop itself acts on them
+_ALWAYS_PARSED = frozenset(("error", "begin", "end"))
 
 
 class TeamTalkServer:
 	"""Represents a single TeamTalk server."""
 
-	def __init__(self, host=None, tcpport=10333):
+	def __init__(self, host=None, tcpport=10333, send_rate=None, send_burst=10, keepalive=None, reconnect=False, reconnect_delay=1.0, reconnect_max_delay=30.0, reconnect_attempts=None, lazy_params=False):
+		"""send_rate limits how many lines per second are sent to the server (allowing bursts of send_burst lines), None means as fast as possible
+		keepalive is the KeepaliveScheduler that pings this server, by default one thread is shared between every connection
+		If reconnect is True, handle_messages re-establishes a dropped connection by itself (see the reconnect method for the other arguments)
+		If lazy_params is True, subscribers get a LazyParams for each event rather than a dict, so values nobody reads are never decoded"""
 		self.set_connection_info(host, tcpport)
+		self.lazy_params = lazy_params
 		self.con = None
-		self.pinger_thread = None
+		self.auto_reconnect = reconnect
+		self.reconnect_delay = reconnect_delay
+		self.reconnect_max_delay = reconnect_max_delay
+		self.reconnect_attempts = reconnect_attempts
+		# how many times the connection has been re-established
+		self.reconnects = 0
+		# what we logged in with and the channel we joined, to do it again after reconnecting
+		self._login_params = None
+		self._rejoin = None
+		self._resuming = False
+		# while reconnecting, the _ResumeState the state handlers fill in instead of us
+		self._staging = None
+		# True while login() is waiting, so a reconnect in the middle of it can let it return
+		self._in_login = False
+		# the start of a line that hadn't fully arrived when a read timed out
+		self._partial = b""
+		# everything we send goes through here, so that threads don't interleave and we don't flood the server
+		self.writer = OutboundWriter(send_rate, send_burst)
+		self.keepalive = keepalive or default_keepalive
+		self.ping_interval = 0
+		# round trip time of the last answered ping, in seconds
+		self.ping_rtt = None
+		self._ping_sent = None
 		self.message_thread = None
 		self.disconnecting = False
 		self.logging_in = False
 		self.logged_out = False
 		self.current_id = 0
 		self.last_id = 0
+		# id 1 is reserved for the login sequence
+		self._next_id = 2
+		self._id_lock = threading.Lock()
+		# maps a command id to its _PendingCommand
+		self._pending = {}
+		# command name -> [count, total seconds, slowest seconds], see command_stats
+		self._command_latency = {}
+		# counters for stats, times are in seconds
+		self.lines_received = 0
+		# lines dropped before being parsed, because no subscriber wanted them
+		self.lines_skipped = 0
+		self.parse_time = 0.0
+		# event -> [count, seconds spent in subscribers, slowest]
+		self._event_stats = {}
+		# if set, called after every event with this server, the event, its parameters and the seconds spent parsing and dispatching it
+		self.trace = None
 		self.subscriptions = {}
-		self.channels = []
-		self.users = []
+		# event -> None if every line must be parsed, or the filters a line has to pass one of, see _wants
+		# rebuilt whenever subscriptions change
+		self._dispatch_table = {}
+		# users, channels and files are indexed so that lookups don't have to scan every entry
+		# rows are compact records rather than the dicts each event was parsed into
+		self._users, self._channels, self._files = self._new_tables()
 		self.me = {}
 		self.server_params = {}
-		self.files = []
+		self._internal_handlers = set()
 		self._subscribe_to_internal_events()
 		self._login_sequence = 0
 
 
+	@staticmethod
+	def _new_tables():
+		"""Returns empty tables for users, channels and files"""
+		return (
+			Table("userid", ("nickname", "chanid"), User),
+			Table("chanid", ("channel",), Channel),
+			Table(("chanid", "filename"), ("fileid", "filename"), File),
+		)
+
+	@property
+	def users(self):
+		"""A list-like view of every user we know about"""
+		return TableView(self._users)
+
+	@property
+	def channels(self):
+		"""A list-like view of every channel we know about"""
+		return TableView(self._channels)
+
+	@property
+	def files(self):
+		"""A list-like view of every file we know about"""
+		return TableView(self._files)
+
 	def set_connection_info(self, host, tcpport=10333):
 		"""Sets the server's host and TCP port"""
 		self.host = host
@@ -274,6 +612,12 @@ class TeamTalkServer:
 	def connect(self):
 		"""Initiates the connection to this server
 		Raises an exception on failure"""
+		self._open()
+		self.writer.attach(self.con.write)
+
+	def _open(self):
+		"""Opens the connection and reads the server's welcome message"""
+		self._partial = b""
 		self.con = telnetlib.Telnet(self.host, self.tcpport)
 		# the first thing we should get is a welcome message
 		welcome = self.read_line(timeout=3)
@@ -286,6 +630,7 @@ class TeamTalkServer:
 			# could mean we're working with a TT 4 server, or different protocol entirely
 			return
 		self.server_params = params
+		self._update_ping_interval()
 
 	def login(self, nickname, username, password, client, protocol="5.6", version="1.0", callback=None):
 		"""Attempts to log in to the server.
@@ -294,7 +639,19 @@ class TeamTalkServer:
 		If callback is specified, it behaves the same as handle_messages for the duration of this sequence.
 		To intersept failed logins, provide a callback and check for the "error" event.
 		"""
-		message = build_tt_message(
+		self._login_params = (nickname, username, password, client, protocol, version)
+		self.send(self._login_message(*self._login_params))
+		self.start_threads()
+		self._login_sequence = 1
+		self._in_login = True
+		try:
+			self.handle_messages(callback=callback)
+		finally:
+			self._in_login = False
+
+	@staticmethod
+	def _login_message(nickname, username, password, client, protocol, version):
+		return build_tt_message(
 			"login",
 			{
 				"nickname": nickname,
@@ -306,38 +663,60 @@ class TeamTalkServer:
 				"id": 1,
 			},
 		)
-		self.send(message)
-		self.start_threads()
-		self._login_sequence = 1
-		self.handle_messages(callback=callback)
 
 	def start_threads(self):
-		self.pinger_thread = threading.Thread(target=self.handle_pings)
-		self.pinger_thread.daemon = True
-		self.pinger_thread.start()
+		"""Starts keeping this connection alive"""
+		self.keepalive.add(self)
 
 	def read_line(self, timeout=None):
-		"""Reads and returns a line from the server"""
+		"""Reads and returns a line from the server.
+		Returns b"" if no complete line arrived within timeout seconds, or False if we are disconnecting.
+		Raises EOFError or OSError if the connection was lost"""
 		if self.disconnecting:
 			return False
-		return self.con.read_until(b"\r\n", timeout)
+		try:
+			line = self.con.read_until(b"\r\n", timeout)
+		except AttributeError:
+			# telnetlib drops its socket if we're disconnected from another thread mid read
+			if self.disconnecting:
+				return False
+			raise
+		if self._partial:
+			line = self._partial + line
+			self._partial = b""
+		if line and not line.endswith(b"\r\n"):
+			# timed out half way through a line, keep what we have for next time
+			self._partial = line
+			return b""
+		return line
 
 	def send(self, line):
 		"""Sends a line to the server"""
 		if self.disconnecting:
 			return False
+		self.writer.send(self._encode_line(line))
+
+	@staticmethod
+	def _encode_line(line):
+		"""Returns line as bytes ready to be written to the server"""
+		if isinstance(line, bytes) and line.endswith(b"\r\n"):
+			# already a whole line, E.G. from build_tt_line
+			return line
 		if isinstance(line, str):
 			line = line.encode()
 		line = line.replace(b"\n", b"\r")
 		if not line.endswith(b"\r\n"):
 			line += b"\r\n"
-		self.con.write(line)
+		return line
 
 	def disconnect(self):
 		"""Disconnect from this server.
 		Signals all threads to stop"""
 		self.disconnecting = True
+		self.keepalive.remove(self)
+		self.writer.close()
 		self.con.close()
+		self._fail_pending(ConnectionLost("Disconnected before the server responded"))
 
 	def handle_messages(self, timeout=1, callback=None):
 		"""Processes all incoming messages
@@ -350,77 +729,426 @@ class TeamTalkServer:
 			if self._login_sequence == 2:
 				self._login_sequence = 0
 				break
-			line = self.read_line(timeout)
-			line = line.strip()
-			if line == b"pong":
-				# response to ping, which is handled internally
-				# we don't actually care about getting something back, we just send them to make the server happy
-				line = b"" # drop it
 			try:
-				line = line.decode()
-			except UnicodeDecodeError:
-				print("failed to decode line: " + line)
-				if callable(callback):
-					callback(self, "", {})
+				line = self.read_line(timeout)
+			except (EOFError, OSError) as e:
+				if self.disconnecting:
+					break
+				self._connection_lost(str(e) or type(e).__name__)
 				continue
-			if not line:
-				if callable(callback):
-					callback(self, "", {})
-				continue # nothing to do
-			event, params = parse_tt_message(line)
-			event = event.lower()
-			if event == "error":
-				# indicates success or irrelevance
-				if params["number"] == CMD_ERR_IGNORE or params["number"] == CMD_ERR_SUCCESS:
-					continue
-				raise TeamTalkError(params["number"], params["message"])
-			# Call messages for the event if necessary
-			for func in self.subscriptions.get(event, []):
-				func(self, params)
+			if line is False:
+				break
+			if not line and self._ping_sent is not None and time.monotonic() - self._ping_sent > max(3 * self._ping_interval(), 10):
+				# the socket may look fine long after the server went away, but nobody answers pings
+				self._connection_lost("server stopped responding to pings")
+				continue
+			# the callback is promised every line, so nothing can be skipped
+			result = self._process_line(line, callable(callback))
 			# finally, call the callback
-			if callable(callback):
-				callback(self, event, params)
+			if result and callable(callback):
+				callback(self, *result)
+
+	def _connection_lost(self, reason):
+		"""Called from handle_messages when the connection has gone away.
+		Reconnects if we're meant to, raises ConnectionLost otherwise"""
+		if not self.auto_reconnect or self._resuming or self._login_params is None:
+			raise ConnectionLost(f"Lost connection to {self.host}:{self.tcpport}: {reason}")
+		print(f"Lost connection to {self.host}:{self.tcpport} ({reason}), reconnecting")
+		self.reconnect()
+
+	def reconnect(self):
+		"""Re-establishes the connection, logs back in with the same details and rejoins the channel we last joined.
+		Attempts are retried with exponential backoff, starting at reconnect_delay seconds and going up to reconnect_max_delay,
+		until one succeeds or reconnect_attempts (if not None) have failed, in which case ConnectionLost is raised.
+		Lines sent while disconnected are kept, and written once we are back in our channel.
+		Subscribers aren't sent the flood of users, channels and files that comes with logging in again.
+		Instead they get the difference from what we knew before, as if those changes had just happened, followed by a "reconnected" event."""
+		if self._login_params is None:
+			raise ConnectionLost("Can't reconnect without having logged in first")
+		started = time.monotonic()
+		self._drop_connection()
+		snapshot = self._snapshot()
+		delay = self.reconnect_delay
+		attempts = 0
+		while True:
+			if self.disconnecting:
+				return
+			attempts += 1
+			try:
+				self._resume()
+				break
+			except (OSError, EOFError, TeamTalkError) as e:
+				self._resuming = False
+				self._staging = None
+				self._drop_connection()
+				if self.reconnect_attempts and attempts >= self.reconnect_attempts:
+					raise ConnectionLost(f"Failed to reconnect to {self.host}:{self.tcpport} after {attempts} attempts: {e}") from e
+				print(f"Reconnecting to {self.host}:{self.tcpport} failed ({e}), trying again in {delay:.1f} seconds")
+				# jittered, so many bots don't all come back at the same moment
+				time.sleep(random.uniform(delay / 2, delay))
+				delay = min(delay * 2, self.reconnect_max_delay)
+		self.reconnects += 1
+		self._dispatch_changes(snapshot)
+		self._dispatch("reconnected", {"attempts": attempts, "downtime": time.monotonic() - started})
+
+	def _drop_connection(self):
+		"""Closes the connection without forgetting anything queued to be sent"""
+		self.keepalive.remove(self)
+		self.writer.detach()
+		if self.con:
+			try:
+				self.con.close()
+			except OSError:
+				pass
+		self._ping_sent = None
+		self.current_id = 0
+		self.logging_in = False
+		self._login_sequence = 0
+		# responses to anything sent on the old connection are never coming
+		self._fail_pending(ConnectionLost("Connection lost before the server responded"))
+
+	def _resume(self):
+		"""Connects, logs in and rejoins our channel.
+		Lines are written straight to the socket, so the login goes out before anything that was queued while we were away.
+		What the new login tells us is kept apart until it has succeeded, so until then me, users and channels still describe the old session
+		(and replies sent meanwhile still have somewhere to go)"""
+		self._resuming = True
+		staging = self._staging = _ResumeState(self)
+		self._open()
+		self.con.write(self._encode_line(self._login_message(*self._login_params)))
+		self._read_until("end", timeout=30)
+		if self._rejoin:
+			name, chanid, password = self._rejoin
+			channel = type(self).get_channel(staging, name) or type(self).get_channel(staging, chanid)
+			if channel:
+				self.con.write(build_tt_line("join", {"chanid": channel["chanid"], "password": password}))
+				try:
+					self._read_until("joined", timeout=10)
+				except TeamTalkError as e:
+					# logged in is better than not connected at all
+					print(f"Failed to rejoin {name}: {e}")
+			else:
+				print(f"Channel {name} no longer exists, not rejoining")
+		# logged back in, the new session replaces the old one
+		self.me.clear()
+		self.me.update(staging.me)
+		self._users, self._channels, self._files = staging._users, staging._channels, staging._files
+		self._staging = None
+		self._resuming = False
+		self.writer.attach(self.con.write)
+		self.start_threads()
 
+	def _read_until(self, event, timeout):
+		"""Processes lines until one with the given event arrives.
+		Raises TimeoutError if that takes more than timeout seconds, or TeamTalkError if the server reports an error first"""
+		deadline = time.monotonic() + timeout
+		while True:
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				raise TimeoutError(f"Server didn't send {event} in time")
+			line = self.read_line(remaining)
+			if line is False:
+				raise ConnectionLost("Disconnected")
+			result = self._process_line(line)
+			if result and result[0] == event:
+				# if login() was waiting when the connection dropped, it's done now, otherwise handle_messages shouldn't stop
+				self._login_sequence = 2 if self._in_login else 0
+				return result[1]
+
+	def _snapshot(self):
+		"""Returns copies of everything we know about the server's users, channels and files"""
+		return tuple({key: row.to_dict() for key, row in table.rows.items()} for table in (self._users, self._channels, self._files))
+
+	def _dispatch_changes(self, snapshot):
+		"""Tells subscribers how the server changed since snapshot was taken, with the events that would have announced each change"""
+		users, channels, files = snapshot
+		for key, row in files.items():
+			if key not in self._files:
+				self._dispatch_external("removefile", row)
+		for key, row in users.items():
+			if key not in self._users:
+				self._dispatch_external("loggedout", row)
+		for key, row in channels.items():
+			if key not in self._channels:
+				self._dispatch_external("removechannel", row)
+		for key, row in self._channels.rows.items():
+			before = channels.get(key)
+			if before is None:
+				self._dispatch_external("addchannel", row.to_dict())
+			elif before != row:
+				self._dispatch_external("updatechannel", row.to_dict())
+		for key, row in self._users.rows.items():
+			before = users.get(key)
+			if before is None:
+				self._dispatch_external("loggedin", row.to_dict())
+				before = {}
+			if before.get("chanid") != row.get("chanid"):
+				if before.get("chanid"):
+					self._dispatch_external("removeuser", {"userid": key, "chanid": before["chanid"]})
+				if row.get("chanid"):
+					self._dispatch_external("adduser", row.to_dict())
+			elif before and before != row:
+				self._dispatch_external("updateuser", row.to_dict())
+		for key, row in self._files.rows.items():
+			if key not in files:
+				self._dispatch_external("addfile", row.to_dict())
+
+	def _process_line(self, line, parse_all=False):
+		"""Decodes, parses and dispatches a single line read from the server.
+		Unless parse_all is True, lines no subscriber wants are dropped without being parsed.
+		Returns a tuple of (event, parameters), which is ("", {}) if there was nothing to do, or None if the line should be ignored entirely.
+		Raises TeamTalkError on an error event"""
+		if not line:
+			return "", {} # nothing to do
+		self.lines_received += 1
+		line = line.strip()
+		if line == b"pong":
+			# response to ping, which is handled internally
+			# all we use it for is measuring latency
+			if self._ping_sent is not None:
+				self.ping_rtt = time.monotonic() - self._ping_sent
+				self._ping_sent = None
+			line = b"" # drop it
+		try:
+			line = line.decode()
+		except UnicodeDecodeError:
+			print("failed to decode line: " + repr(line))
+			return "", {}
+		if not line:
+			return "", {} # nothing to do
+		if not parse_all and not self._wants(line):
+			self.lines_skipped += 1
+			return None
+		started = time.perf_counter()
+		event, params = parse_tt_message(line, self.lazy_params)
+		event = event.lower()
+		parsed = time.perf_counter()
+		self.parse_time += parsed - started
+		if event == "error":
+			# indicates success or irrelevance
+			if params["number"] == CMD_ERR_IGNORE or params["number"] == CMD_ERR_SUCCESS:
+				return None
+			error = TeamTalkError(params["number"], params["message"])
+			# errors inside a block someone is waiting on belong to that command, not the reader loop
+			command = self._pending.get(self.current_id)
+			if command is None:
+				raise error
+			command.error = error
+			return event, params
+		# Call messages for the event if necessary
+		self._dispatch(event, params)
+		elapsed = time.perf_counter() - parsed
+		stats = self._event_stats.get(event)
+		if stats is None:
+			stats = self._event_stats[event] = [0, 0.0, 0.0]
+		stats[0] += 1
+		stats[1] += elapsed
+		if elapsed > stats[2]:
+			stats[2] = elapsed
+		if self.trace:
+			self.trace(self, event, params, parsed - started, elapsed)
+		if event != "begin" and event != "end":
+			command = self._pending.get(self.current_id)
+			if command is not None:
+				command.events.append((event, params))
+		return event, params
+
+	def _wants(self, line):
+		"""Returns whether a decoded line has to be parsed, looking at no more of it than necessary"""
+		event = line.split(" ", 1)[0].lower()
+		if event in _ALWAYS_PARSED or self.current_id in self._pending:
+			# part of a response someone is waiting on, which gets every event in it
+			return True
+		if event not in self._dispatch_table:
+			return False
+		filters = self._dispatch_table[event]
+		if filters is None:
+			return True
+		for filter in filters:
+			# None (can't tell) has to be parsed to find out
+			if filter.peek(line) is not False:
+				return True
+		return False
+
+	def _compile_dispatch_table(self):
+		"""Works out which events are wanted, and the filters deciding that for events only subscribed to with where"""
+		table = {}
+		for event, subs in self.subscriptions.items():
+			if not subs:
+				continue
+			filters = []
+			for sub in subs:
+				if not isinstance(sub, _FilteredSubscription):
+					filters = None
+					break
+				filters.append(sub.filter)
+			table[event] = filters
+		self._dispatch_table = table
+
+	def _dispatch(self, event, params):
+		"""Calls every function subscribed to event"""
+		if self._resuming:
+			# our own state goes to the staging copy, subscribers are told what changed once we're back
+			for func in self.subscriptions.get(event, []):
+				if func in self._internal_handlers:
+					func(self._staging, params)
+				elif event not in _STATE_EVENTS:
+					func(self, params)
+			return
+		for func in self.subscriptions.get(event, []):
+			func(self, params)
+
+	def _allocate_id(self):
+		"""Returns an id that isn't used by any pending command"""
+		with self._id_lock:
+			while True:
+				id = self._next_id
+				# TeamTalk ids are 16 bit, wrap around but never hand out the login id
+				self._next_id = id + 1 if id < 0xFFFF else 2
+				if id not in self._pending:
+					return id
+
+	def _new_future(self):
+		return concurrent.futures.Future()
+
+	def _expect(self, id, name="command"):
+		"""Returns a future that resolves once the server finishes responding to the command with the given id"""
+		future = self._new_future()
+		self._pending[id] = _PendingCommand(name, future)
+		return future
+
+	def _resolve(self, id):
+		"""Completes the future for id, called when its end event arrives"""
+		command = self._pending.pop(id, None)
+		if command is None:
+			return
+		latency = time.monotonic() - command.sent
+		stats = self._command_latency.setdefault(command.name, [0, 0.0, 0.0])
+		stats[0] += 1
+		stats[1] += latency
+		stats[2] = max(stats[2], latency)
+		if command.future.done():
+			return
+		if command.error:
+			command.future.set_exception(command.error)
+		else:
+			command.future.set_result(command.events)
+
+	def _fail_pending(self, error):
+		"""Fails every command still waiting on a response"""
+		pending, self._pending = self._pending, {}
+		for command in pending.values():
+			if not command.future.done():
+				command.future.set_exception(error)
+
+	def command(self, helper, *args, callback=None, **kwargs):
+		"""Calls one of the helpers (join, kick, user_message, etc) with a fresh id, so its response can be told apart from everything else.
+		Returns a concurrent.futures.Future, resolving to the list of (event, parameters) tuples the server sent in response, or raising TeamTalkError if it rejected the command.
+		If callback is given, it is called with the future once it's done.
+		Many commands can be in flight at once. The future is resolved by handle_messages, so don't wait on it from the thread running that."""
+		id = self._allocate_id()
+		future = self._expect(id, getattr(helper, "__name__", "command"))
+		if callback:
+			future.add_done_callback(callback)
+		helper(*args, id=id, **kwargs)
+		return future
+
+	@property
+	def pending_commands(self):
+		"""Number of commands waiting on a response"""
+		return len(self._pending)
+
+	def command_stats(self):
+		"""Returns a dict mapping each command sent through command to its response time: count, mean and max seconds"""
+		return {
+			name: {"count": count, "time": total, "mean": total / count, "max": slowest}
+			for name, (count, total, slowest) in list(self._command_latency.items())
+		}
+
+	def stats(self):
+		"""Returns a dict describing how this connection is doing, times are in seconds.
+		events maps every event seen to how many arrived and the time spent in its subscribers (when they don't use an executor)"""
+		return {
+			"lines_received": self.lines_received,
+			"lines_skipped": self.lines_skipped,
+			"parse_time": self.parse_time,
+			"events": {
+				event: {"count": count, "time": total, "max": slowest}
+				for event, (count, total, slowest) in list(self._event_stats.items())
+			},
+			"commands": self.command_stats(),
+			"pending_commands": len(self._pending),
+			"ping_rtt": self.ping_rtt,
+			"reconnects": self.reconnects,
+			"writer": self.writer.stats(),
+		}
+
+	def _dispatch_external(self, event, params):
+		"""Calls every function subscribed to event, except the ones keeping our own state"""
+		for func in self.subscriptions.get(event, []):
+			if func not in self._internal_handlers:
+				func(self, params)
 
-	def _sleep(self, seconds):
-		"""Like time.sleep, but immediately halts execution if we need to disconnect from a server"""
-		starttime = time.time()
-		while not self.disconnecting and time.time() - starttime <= seconds:
-			time.sleep(0.005)
 
-	def handle_pings(self):
-		"""Handles pinging the server at a reasonable interval.
-		Intervals are calculated based on the server's usertimeout value.
-		This function always runs in it's own thread."""
-		pingtime = 0
-		while not self.disconnecting:
-			self.send("ping")
-			# in case usertimeout was changed somehow
-			# logic from TTCom, which had a preferable approach to TT clients for what we're doing
-			# better safe than sorry
-			pingtime = float(self.server_params["usertimeout"])
-			if pingtime < 1:
-				pingtime = 0.3
-			elif pingtime < 1.5:
-				pingtime = 0.5
-			else:
-				pingtime *= 0.75
-			self._sleep(pingtime)
+	def _keepalive(self):
+		"""Called by the keepalive scheduler when this connection may need a ping.
+		Skips the ping if something else was sent recently, since any traffic keeps us alive.
+		Returns how many seconds until we should be checked again"""
+		interval = self._ping_interval()
+		idle = time.monotonic() - self.writer.last_write
+		if idle < interval and self.writer.last_write:
+			return interval - idle
+		if self._ping_sent is None:
+			self._ping_sent = time.monotonic()
+		self.send("ping")
+		return interval
+
+	def _ping_interval(self):
+		"""Returns how long to wait between pings"""
+		if not self.ping_interval:
+			self._update_ping_interval()
+		return self.ping_interval
+
+	def _update_ping_interval(self):
+		"""Works out the ping interval from the server's usertimeout value.
+		Called whenever usertimeout may have changed"""
+		# logic from TTCom, which had a preferable approach to TT clients for what we're doing
+		# better safe than sorry
+		pingtime = float(self.server_params.get("usertimeout", 0))
+		if pingtime < 1:
+			pingtime = 0.3
+		elif pingtime < 1.5:
+			pingtime = 0.5
+		else:
+			pingtime *= 0.75
+		self.ping_interval = pingtime
 
-	def subscribe(self, event, func=None):
+	def subscribe(self, event, func=None, executor=None, key=None, where=None):
 		"""Starts calling func every time event is encountered, passing along a copy of this class as well as the parameters from the TT message
 		This can also be used as a decorator
+		If executor is given (anything with a submit method, E.G. a ThreadPoolExecutor), func runs there instead of blocking handle_messages.
+			key can then be a function taking the event's parameters and returning a hashable value.
+			Calls that produce the same key are guaranteed to run in the order their events arrived.
+		If where is given, func is only called for events whose parameters match it.
+			where maps parameter names to a value, or to a function taking the value and returning True if it matches.
+			E.G. where={"type": CHANNEL_MSG, "chanid": 5} for messages to channel 5.
+			Lines no subscriber could want are dropped before they are parsed, which is where most of the time goes.
 		"""
 
 		def wrapper(_func):
 			evt = event.lower()
+			if executor:
+				_func = _DispatchedSubscription(_func, SerialDispatcher(executor), key)
+			if where:
+				_func = _FilteredSubscription(_func, where)
 			subs = self.subscriptions.get(evt)
 			# events are added as we subscribe to them
 			if subs:
 				self.subscriptions[evt].append(_func)
 			else:
 				self.subscriptions[evt] = [_func]
-			return _func
+			self._compile_dispatch_table()
+			return getattr(_func, "func", _func)
 
 		if func:
 			return wrapper(func)
@@ -431,7 +1159,14 @@ class TeamTalkServer:
 		"""Stops calling func when event is encountered
 		Raises a KeyError or ValueError on failure"""
 		event = event.lower()
-		self.subscriptions[event].remove(func)
+		subs = self.subscriptions[event]
+		for sub in subs:
+			# dispatched subscriptions are wrapped, compare against the original function
+			if getattr(sub, "func", sub) == func:
+				subs.remove(sub)
+				self._compile_dispatch_table()
+				return
+		raise ValueError(f"{func!r} is not subscribed to {event}")
 
 	def _subscribe_to_internal_events(self):
 		"""Subscribes to all internal events that keep track of the server's state.
@@ -444,28 +1179,29 @@ class TeamTalkServer:
 			func = getattr(self, func)
 			if callable(func):
 				self.subscribe(event, func)
+				self._internal_handlers.add(func)
 
 	def get_channel(self, id, index=False):
 		"""Retrieves attributes for channels with the requested id.
 		If index is False, returns a dict. Otherwise, returns the channel's index in self.channels
 		If id is of type str, look for matching names
 		If id is an int, look for matching chanid's
-		If id is a dict, we assume params are lazily being passed and try searching for a chanid"""
-		if isinstance(id, dict):
+		If id is a dict (or record), we assume params are lazily being passed and try searching for a chanid"""
+		if isinstance(id, Mapping):
 			id = id.get("chanid")
 			if not id:
 				return
-		found = False
-		for i, channel in enumerate(self.channels):
-			if isinstance(id, int) and channel["chanid"] == id:
-				found = True
-			elif isinstance(id, str) and channel["channel"] == id:
-				found = True
-			if found:
-				if index:
-					return i
-				else:
-					return channel
+		if isinstance(id, int):
+			channel = self._channels.get(id)
+		elif isinstance(id, str):
+			channel = self._channels.find("channel", id)
+		else:
+			return
+		if channel is None:
+			return
+		if index:
+			return self._channels.position(channel["chanid"])
+		return channel
 
 	def get_user(self, id, index=False):
 		"""Retrieves attributes for users with the requested id.
@@ -473,23 +1209,23 @@ class TeamTalkServer:
 		If id is of type str, look for matching nicknames
 			Be careful, though, as teamtalk imposes no limit on users with identical nicknames.
 		If id is an int, look for matching userids
-		If id is a dict, we assume params are lazily being passed and try searching for a userid
+		If id is a dict (or record), we assume params are lazily being passed and try searching for a userid
 		"""
-		if isinstance(id, dict):
+		if isinstance(id, Mapping):
 			id = id.get("userid")
 			if not id:
 				return
-		found = False
-		for i, user in enumerate(self.users):
-			if isinstance(id, int) and user["userid"] == id:
-				found = True
-			elif isinstance(id, str) and user["nickname"] == id:
-				found = True
-			if found:
-				if index:
-					return i
-				else:
-					return user
+		if isinstance(id, int):
+			user = self._users.get(id)
+		elif isinstance(id, str):
+			user = self._users.find("nickname", id)
+		else:
+			return
+		if user is None:
+			return
+		if index:
+			return self._users.position(user["userid"])
+		return user
 
 	def get_file(self, id, channel=None, index=False):
 		"""Retrieves attributes for files with the requested id.
@@ -498,39 +1234,44 @@ class TeamTalkServer:
 		If id is of type str, look for matching filenames
 			Be careful, though, as teamtalk imposes no limit on files with the same name in different channels.
 		If id is an int, look for matching fileids
-		If id is a dict, we assume params are lazily being passed and try searching for a fileid"""
-		if isinstance(id, dict):
+		If id is a dict (or record), we assume params are lazily being passed and try searching for a fileid"""
+		if isinstance(id, Mapping):
 			id = id.get("fileid")
 			if not id:
 				return
-		channel = self.get_channel(channel)
-		channel = channel.get("chanid")
-		found = False
-		for i, file in enumerate(self.files):
-			if isinstance(id, int) and file["fileid"] == id:
-				if channel and file["chanid"] == channel:
-					found = True
-			elif isinstance(id, str) and file["filename"] == id:
-				if channel and file["chanid"] == channel:
-					found = True
-			if found:
-				if index:
-					return i
-				else:
-					return file
+		chanid = None
+		if channel:
+			channel = self.get_channel(channel)
+			if not channel:
+				return
+			chanid = channel.get("chanid")
+		if isinstance(id, int):
+			files = self._files.find_all("fileid", id)
+		elif isinstance(id, str):
+			if chanid:
+				file = self._files.get((chanid, id))
+				files = [file] if file else []
+			else:
+				files = self._files.find_all("filename", id)
+		else:
+			return
+		for file in files:
+			if chanid and file["chanid"] != chanid:
+				continue
+			if index:
+				return self._files.position(self._files.key_of(file))
+			return file
 
 	def get_users_in_channel(self, id=None):
 		"""Retrieves a list of users in the specified channel.
 		id can be anything accepted by get_channel
 		There is one exception, however. If None, looks for users that aren't said to be in any channel"""
-		users = []
 		if id:
 			channel = self.get_channel(id)
+			if not channel:
+				return []
 			id = channel.get("chanid")
-		for user in self.users:
-			if user.get("chanid") == id:
-				users.append(user)
-		return users
+		return self._users.find_all("chanid", id)
 
 	def get_role(self, user=None):
 		"""Returns an str representing the provided user's role.
@@ -558,20 +1299,21 @@ class TeamTalkServer:
 		An "error" event is thrown on failure, "joined" on success"""
 		channel = self.get_channel(channel)
 		chanid = channel["chanid"]
+		# channel ids may change if the server restarts, the path is more likely to survive
+		self._rejoin = (channel.get("channel"), chanid, password)
 		params = {"chanid": chanid, "password": password}
 		if id:
 			params["id"] = id
-		msg = build_tt_message("join", params)
-		self.send(msg)
+		self.send(build_tt_line("join", params))
 
 	def leave(self, id=None):
 		"""Leaves the current channel.
 		An "error" event is thrown on failure, "left" on success"""
+		self._rejoin = None
 		params = {}
 		if id:
 			params["id"] = id
-		msg = build_tt_message("leave", params)
-		self.send(msg)
+		self.send(build_tt_line("leave", params))
 
 	def kick(self, target, channel=None, id=None):
 		"""Kicks the provided user from a channel (if specified) otherwise the server.
@@ -586,8 +1328,7 @@ class TeamTalkServer:
 			params["chanid"] = channel
 		if id:
 			params["id"] = id
-		msg = build_tt_message("kick", params)
-		self.send(msg)
+		self.send(build_tt_line("kick", params))
 
 	def move(self, user, destination, id=None):
 		"""Moves the provided user to destination.
@@ -600,8 +1341,7 @@ class TeamTalkServer:
 		params = {"userid": user, "chanid": channel}
 		if id:
 			params["id"] = id
-		msg = build_tt_message("moveuser", params)
-		self.send(msg)
+		self.send(build_tt_line("moveuser", params))
 
 	def change_status(self, statusmode, statusmsg, id=None):
 		"""
@@ -614,16 +1354,14 @@ class TeamTalkServer:
 		params = {"statusmode": statusmode, "statusmsg" : statusmsg}
 		if id:
 			params["id"] = id
-		msg = build_tt_message("changestatus", params)
-		self.send(msg)
+		self.send(build_tt_line("changestatus", params))
 
 	def change_nickname(self, nickname, id=None):
 		"""Changes the nickname for the current user."""
 		params = {"nickname": nickname}
 		if id:
 			params["id"] = id
-		msg = build_tt_message("changenick", params)
-		self.send(msg)
+		self.send(build_tt_line("changenick", params))
 
 	def user_message(self, to, content, id=None):
 		"""Sends a private message to a user on this server.
@@ -634,8 +1372,7 @@ class TeamTalkServer:
 		params = {"type": USER_MSG, "content": content, "destuserid": to}
 		if id:
 			params["id"] = id
-		msg = build_tt_message("message", params)
-		self.send(msg)
+		self.send(build_tt_line("message", params))
 
 	def channel_message(self, content, to=None, id=None):
 		"""Sends a channel message.
@@ -651,8 +1388,7 @@ class TeamTalkServer:
 		params = {"type": CHANNEL_MSG, "content": content, "chanid": to}
 		if id:
 			params["id"] = id
-		msg = build_tt_message("message", params)
-		self.send(msg)
+		self.send(build_tt_line("message", params))
 
 	def broadcast_message(self, content, id=None):
 		"""Sends a broadcast (serverwide) message.
@@ -660,8 +1396,7 @@ class TeamTalkServer:
 		params = {"type": BROADCAST_MSG, "content": content}
 		if id:
 			params["id"] = id
-		msg = build_tt_message("message", params)
-		self.send(msg)
+		self.send(build_tt_line("message", params))
 
 	def remove_channel(self, channel, id=None):
 		"""Removes a channel from the server, only available to admins.
@@ -671,8 +1406,7 @@ class TeamTalkServer:
 		params = {"chanid": chanid}
 		if id:
 			params["id"] = id
-		msg = build_tt_message("removechannel", params)
-		self.send(msg)
+		self.send(build_tt_line("removechannel", params))
 
 	def channel_operator(self, user=None, channel=None, password="", op=True, id=None):
 		"""Grants operator privileges on the provided channel.
@@ -694,8 +1428,7 @@ class TeamTalkServer:
 		params = {"chanid": channel, "userid": user, "opstatus": op}
 		if id:
 			params["id"] = id
-		msg = build_tt_message("op", params)
-		self.send(msg)
+		self.send(build_tt_line("op", params))
 
 	def subscribe_to(self, user, subscription, id=None):
 		"""Subscribe to an event on this server for a given user.
@@ -707,8 +1440,7 @@ class TeamTalkServer:
 		params = {"userid": user, "sublocal": subscription}
 		if id:
 			params["id"] = id
-		msg = build_tt_message("subscribe", params)
-		self.send(msg)
+		self.send(build_tt_line("subscribe", params))
 
 	def unsubscribe_from(self, user, subscription, id=None):
 		"""Unsubscribes from an event on this server for a given user.
@@ -720,8 +1452,7 @@ class TeamTalkServer:
 		params = {"userid": user, "sublocal": subscription}
 		if id:
 			params["id"] = id
-		msg = build_tt_message("unsubscribe", params)
-		self.send(msg)
+		self.send(build_tt_line("unsubscribe", params))
 
 
 	# Internal event responses
@@ -766,18 +1497,13 @@ class TeamTalkServer:
 		if params["id"] == 1:
 			self.logging_in = False
 			self._login_sequence = 2
+		self._resolve(params["id"])
 
 	@staticmethod
 	def _handle_loggedin(self, params):
 		"""Event fired when a user has just logged in.
 		Is also sent during login for every currently logged in user"""
-		user_index = self.get_user(params["userid"], index=True)
-		if not user_index:
-			self.users.append(params)
-		else:
-			# something was updated
-			# I don't think this should happen, but just to be sure
-			self.users[user_index].update(params)
+		self._users.add(params)
 
 	@staticmethod
 	def _handle_loggedout(self, params):
@@ -786,9 +1512,7 @@ class TeamTalkServer:
 			self.logged_out = True
 			self.disconnect()
 		else:
-			user = self.get_user(params["userid"])
-			if user:
-				self.users.remove(user)
+			self._users.remove(params["userid"])
 
 	@staticmethod
 	def _handle_accepted(self, params):
@@ -802,31 +1526,24 @@ class TeamTalkServer:
 		"""Event fired after login that exposes more info to a client
 		May also mean that attributes of this server have changed"""
 		self.server_params.update(params)
+		if "usertimeout" in params:
+			self._update_ping_interval()
 
 	@staticmethod
 	def _handle_addchannel(self, params):
 		"""Event fired when a new channel has been created
 		Can also be used to tell a newly connected user about a channel"""
-		chan_index = self.get_channel(params["chanid"], index=True)
-		if not chan_index:
-			self.channels.append(params)
-		else:
-			# shouldn't happen
-			self.channels[chan_index].update(params)
+		self._channels.add(params)
 
 	@staticmethod
 	def _handle_updatechannel(self, params):
 		"""Event fired when an attribute of a channel has changed"""
-		chan_index = self.get_channel(params["chanid"], index=True)
-		if chan_index:
-			self.channels[chan_index].update(params)
+		self._channels.update(params["chanid"], params)
 
 	@staticmethod
 	def _handle_removechannel(self, params):
 		"""Event fired when a channel is deleted"""
-		channel = self.get_channel(params["chanid"])
-		if channel:
-			self.channels.remove(channel)
+		self._channels.remove(params["chanid"])
 
 	@staticmethod
 	def _handle_joined(self, params):
@@ -842,33 +1559,25 @@ class TeamTalkServer:
 	def _handle_adduser(self, params):
 		"""Event fired when a user is added (manually joins or is moved) to a channel.
 		Can also be used to tell a newly connected user about the location of other users on the server"""
-		user_index = self.get_user(params["userid"], index=True)
-		if user_index != None:
-			self.users[user_index].update(params)
+		self._users.update(params["userid"], params)
 
 	@staticmethod
 	def _handle_removeuser(self, params):
 		"""Event fired when a user is removed from (or leaves) a channel"""
-		user_index = self.get_user(params["userid"], index=True)
-		if user_index != None:
-			del self.users[user_index]["chanid"]
+		self._users.discard_field(params["userid"], "chanid")
 
 	@staticmethod
 	def _handle_updateuser(self, params):
 		"""Event fired when an attribute of a user has changed"""
-		user_index = self.get_user(params["userid"], index=True)
-		if user_index != None:
-			self.users[user_index].update(params)
+		self._users.update(params["userid"], params)
 
 	@staticmethod
 	def _handle_addfile(self, params):
 		"""Event fired after a user joins a channel where files are available.
 		Sent for every downloadable file."""
-		self.files.append(params)
+		self._files.add(params)
 
 	@staticmethod
 	def _handle_removefile(self, params):
 		"""Event fired when a file is removed from a channel."""
-		file_index = self.get_file(params["filename"], params["chanid"], index=True)
-		if file_index != None:
-			del self.files[file_index]
+		self._files.remove((params["chanid"], params["filename"]))
@@ -0,0 +1,138 @@
+"""Buffered, paced writing of lines to a TeamTalk server."""
+
+
+import time
+import threading
+from collections import deque
+
+
+class OutboundWriter:
+	"""Writes lines to a connection from a single background thread.
+	Lines queued while the thread is busy are coalesced into one write.
+	Writes are paced by a token bucket of rate lines per second (allowing bursts of burst lines), so long replies don't trip the server's command flood protection.
+	A rate of None disables pacing.
+	Lines queued while no connection is attached (or after a failed write) are kept until one is."""
+
+	def __init__(self, rate=None, burst=10):
+		self.rate = rate
+		self.burst = burst
+		self.lines_sent = 0
+		self.bytes_sent = 0
+		self.writes = 0
+		self.max_queue_depth = 0
+		# time.monotonic() of the last successful write
+		self.last_write = 0.0
+		self._write = None
+		self._queue = deque()
+		self._condition = threading.Condition()
+		self._tokens = burst
+		self._updated = time.monotonic()
+		self._closed = False
+		self._thread = None
+
+	@property
+	def queue_depth(self):
+		"""Number of lines waiting to be written"""
+		return len(self._queue)
+
+	def attach(self, write):
+		"""Starts writing queued lines with write, a function taking bytes (E.G. a socket's sendall)"""
+		with self._condition:
+			self._write = write
+			self._closed = False
+			if not self._thread or not self._thread.is_alive():
+				self._thread = threading.Thread(target=self._run, name="teamtalk-writer")
+				self._thread.daemon = True
+				self._thread.start()
+			self._condition.notify_all()
+
+	def detach(self):
+		"""Stops writing, anything still queued is kept for the next attach"""
+		with self._condition:
+			self._write = None
+			self._condition.notify_all()
+
+	def send(self, line):
+		"""Queues line (bytes, including the line terminator) to be written"""
+		with self._condition:
+			self._queue.append(line)
+			if len(self._queue) > self.max_queue_depth:
+				self.max_queue_depth = len(self._queue)
+			self._condition.notify_all()
+
+	def flush(self, timeout=None):
+		"""Waits until every queued line has been written, or timeout seconds pass.
+		Returns True if the queue was emptied"""
+		with self._condition:
+			return self._condition.wait_for(lambda: not self._queue or not self._write, timeout) and not self._queue
+
+	def clear(self):
+		"""Drops every queued line"""
+		with self._condition:
+			self._queue.clear()
+			self._condition.notify_all()
+
+	def close(self):
+		"""Stops the background thread, dropping anything still queued"""
+		with self._condition:
+			self._closed = True
+			self._write = None
+			self._queue.clear()
+			self._condition.notify_all()
+
+	def _available(self):
+		"""Returns how many lines may be written right now"""
+		if self.rate is None:
+			return len(self._queue)
+		now = time.monotonic()
+		self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+		self._updated = now
+		return int(self._tokens)
+
+	def _run(self):
+		while True:
+			with self._condition:
+				while True:
+					if self._closed:
+						return
+					if self._queue and self._write:
+						available = self._available()
+						if available >= 1:
+							break
+						# wait for the bucket to refill enough for one line
+						self._condition.wait((1 - self._tokens) / self.rate)
+					else:
+						self._condition.wait()
+				count = min(available, len(self._queue))
+				batch = [self._queue.popleft() for i in range(count)]
+				write = self._write
+			data = b"".join(batch)
+			try:
+				write(data)
+			except (OSError, EOFError, AttributeError):
+				# connection went away, keep the lines for whoever reconnects
+				with self._condition:
+					self._queue.extendleft(reversed(batch))
+					if self._write is write:
+						self._write = None
+					self._condition.notify_all()
+				continue
+			with self._condition:
+				if self.rate is not None:
+					self._tokens -= count
+				self.lines_sent += count
+				self.bytes_sent += len(data)
+				self.writes += 1
+				self.last_write = time.monotonic()
+				self._condition.notify_all()
+
+	def stats(self):
+		"""Returns a dict of counters describing the writer"""
+		with self._condition:
+			return {
+				"queue_depth": len(self._queue),
+				"max_queue_depth": self.max_queue_depth,
+				"lines_sent": self.lines_sent,
+				"bytes_sent": self.bytes_sent,
+				"writes": self.writes,
+			}
@@ -0,0 +1,11 @@
+from ttgpt.workers import *
+from ttgpt.persistence import *
+from ttgpt.chunker import *
+from ttgpt.cache import *
+from ttgpt.scheduler import *
+from ttgpt.ratelimit import *
+from ttgpt.context import *
+from ttgpt.backends import *
+from ttgpt.connection import *
+from ttgpt.retry import *
+from ttgpt.metrics import *
@@ -0,0 +1,274 @@
+"""Completion backends.
+
+Every backend takes a prompt plus completion parameters (model, max_tokens, temperature, stop, ...) and returns the generated text, either all at once (complete) or piece by piece (stream).
+"""
+
+
+import json
+import time
+
+from ttgpt.connection import ConnectionPool
+from ttgpt.retry import RetryPolicy, CircuitBreaker
+
+
+class BackendError(Exception):
+	"""Raised when a backend fails to produce a completion.
+	status is the HTTP status code, if the failure came with one"""
+
+	def __init__(self, message, status=None):
+		super().__init__(message)
+		self.status = status
+
+
+class CircuitOpenError(BackendError):
+	"""Raised instead of attempting a request while a backend's circuit breaker is open"""
+
+
+class CompletionBackend:
+	"""Base class for completion backends"""
+
+	name = "backend"
+
+	def complete(self, prompt, **params):
+		"""Returns the completion for prompt"""
+		raise NotImplementedError
+
+	def stream(self, prompt, **params):
+		"""Yields the completion for prompt as it is generated.
+		Backends that can't stream yield the whole completion at once"""
+		yield self.complete(prompt, **params)
+
+
+def _completion_text(data, source):
+	"""Returns the text of a decoded completion response, raising BackendError if it isn't shaped like one"""
+	try:
+		return data["choices"][0]["text"]
+	except (KeyError, IndexError, TypeError) as e:
+		raise BackendError(f"Unexpected response from {source}: {e!r}") from e
+
+
+def _decode(data, source):
+	"""Decodes a JSON response body, raising BackendError if it isn't valid"""
+	try:
+		return json.loads(data)
+	except ValueError as e:
+		raise BackendError(f"Invalid response from {source}: {e}") from e
+
+
+class HTTPBackend(CompletionBackend):
+	"""Completions from any server speaking the OpenAI completions protocol over plain HTTP, E.G. ttgpt.fake_server.
+	url is the API root, such as http://localhost:8080/v1
+	Up to pool_size connections are kept alive and reused, and each request has timeout seconds to complete"""
+
+	name = "http"
+
+	def __init__(self, url, api_key=None, timeout=60, pool_size=10):
+		self.url = url.rstrip("/") + "/completions"
+		self.api_key = api_key
+		self.pool = ConnectionPool(url, pool_size, timeout)
+
+	def _request(self, prompt, params):
+		body = json.dumps(dict(params, prompt=prompt)).encode()
+		headers = {"Content-Type": "application/json"}
+		if self.api_key:
+			headers["Authorization"] = "Bearer " + self.api_key
+		try:
+			response = self.pool.request("POST", "/completions", body, headers)
+		except OSError as e:
+			raise BackendError(f"Request to {self.url} failed: {e}") from e
+		if response.status != 200:
+			with response:
+				body = response.read()
+			message = response.reason
+			try:
+				# OpenAI style APIs explain what went wrong in the body
+				message = json.loads(body)["error"]["message"]
+			except (ValueError, KeyError, TypeError):
+				pass
+			raise BackendError(f"{self.url} returned {response.status}: {message}", response.status)
+		return response
+
+	def complete(self, prompt, **params):
+		with self._request(prompt, params) as response:
+			try:
+				body = response.read()
+			except OSError as e:
+				raise BackendError(f"Request to {self.url} failed: {e}") from e
+		return _completion_text(_decode(body, self.url), self.url)
+
+	def stream(self, prompt, **params):
+		params["stream"] = True
+		with self._request(prompt, params) as response:
+			try:
+				# server sent events, one "data: {...}" line per piece
+				for line in response:
+					line = line.strip()
+					if not line.startswith(b"data:"):
+						continue
+					data = line[5:].strip()
+					if data == b"[DONE]":
+						# read up to the end of the body, or the connection can't go back to the pool
+						response.read()
+						break
+					yield _completion_text(_decode(data, self.url), self.url)
+			except OSError as e:
+				raise BackendError(f"Request to {self.url} failed: {e}") from e
+
+
+class OpenAIBackend(HTTPBackend):
+	"""Completions from the OpenAI API.
+	api_base can point at any compatible endpoint instead.
+	Requests go through the same keep-alive connection pool as HTTPBackend, up to pool_size connections, and give up after timeout seconds.
+	Retrying is left to ResilientBackend"""
+
+	name = "openai"
+
+	def __init__(self, api_key, api_base=None, timeout=60, pool_size=10):
+		super().__init__(api_base or "https://api.openai.com/v1", api_key, timeout, pool_size)
+
+
+class ResilientBackend(CompletionBackend):
+	"""Wraps another backend, retrying failed requests according to retry (a RetryPolicy).
+	If breaker (a CircuitBreaker) is given, requests fail straight away with CircuitOpenError while the upstream looks down.
+	A stream is only retried if it failed before producing anything"""
+
+	def __init__(self, backend, retry=None, breaker=None):
+		self.backend = backend
+		self.retry = retry or RetryPolicy()
+		self.breaker = breaker
+		self.name = backend.name
+		self.retries = 0
+
+	def _allow(self):
+		if self.breaker and not self.breaker.allow():
+			raise CircuitOpenError(f"{self.name} backend is unavailable, not trying it for now")
+
+	def _record(self, error):
+		"""Tells the breaker about a BackendError, returning whether it's worth retrying"""
+		retryable = self.retry.retryable(error)
+		if self.breaker:
+			if retryable:
+				self.breaker.record_failure()
+			else:
+				# the upstream answered, it just didn't like the request
+				self.breaker.record_success()
+		return retryable
+
+	def _failed(self, error, attempt):
+		"""Records a failure, returning True if the request should be tried again"""
+		if not self._record(error) or attempt + 1 >= self.retry.max_attempts:
+			return False
+		self.retries += 1
+		time.sleep(self.retry.delay(attempt))
+		return True
+
+	def _succeeded(self):
+		if self.breaker:
+			self.breaker.record_success()
+
+	def _crashed(self):
+		"""Records anything other than a BackendError, so that a half-open breaker's trial is never left running"""
+		if self.breaker:
+			self.breaker.record_failure()
+
+	def complete(self, prompt, **params):
+		attempt = 0
+		while True:
+			self._allow()
+			try:
+				result = self.backend.complete(prompt, **params)
+			except BackendError as e:
+				if not self._failed(e, attempt):
+					raise
+				attempt += 1
+				continue
+			except Exception:
+				self._crashed()
+				raise
+			self._succeeded()
+			return result
+
+	def stream(self, prompt, **params):
+		attempt = 0
+		while True:
+			self._allow()
+			started = False
+			try:
+				for text in self.backend.stream(prompt, **params):
+					started = True
+					yield text
+			except BackendError as e:
+				if started:
+					# part of it has been passed on, so it can't be retried
+					self._record(e)
+					raise
+				if not self._failed(e, attempt):
+					raise
+				attempt += 1
+				continue
+			except GeneratorExit:
+				# whoever was reading stopped early, the upstream was doing fine
+				self._succeeded()
+				raise
+			except Exception:
+				self._crashed()
+				raise
+			self._succeeded()
+			return
+
+
+class FailoverBackend(CompletionBackend):
+	"""Tries each of backends in order until one succeeds.
+	A stream only fails over if the failing backend hadn't produced anything yet"""
+
+	name = "failover"
+
+	def __init__(self, backends):
+		self.backends = backends
+
+	def complete(self, prompt, **params):
+		error = None
+		for backend in self.backends:
+			try:
+				return backend.complete(prompt, **params)
+			except BackendError as e:
+				error = e
+		raise error
+
+	def stream(self, prompt, **params):
+		error = None
+		for backend in self.backends:
+			started = False
+			try:
+				for text in backend.stream(prompt, **params):
+					started = True
+					yield text
+				return
+			except BackendError as e:
+				if started:
+					raise
+				error = e
+		raise error
+
+
+def create_backend(options, api_key=None):
+	"""Builds a backend from a dict of options, as found in config.json.
+	options["type"] is "openai" (the default) or "http", a list of option dicts builds a FailoverBackend.
+	api_key is used by openai backends if options doesn't contain one. http backends only send a key given in their own options, so the OpenAI key never goes anywhere else.
+	Every backend is wrapped in a ResilientBackend, configured by "retries", "backoff", "max_backoff", "breaker_threshold" and "breaker_reset"."""
+	if isinstance(options, list):
+		if len(options) == 1:
+			return create_backend(options[0], api_key)
+		return FailoverBackend([create_backend(o, api_key) for o in options])
+	kind = options.get("type", "openai")
+	timeout = options.get("timeout", 60)
+	pool_size = options.get("pool_size", 10)
+	if kind == "openai":
+		backend = OpenAIBackend(options.get("api_key", api_key), options.get("api_base"), timeout, pool_size)
+	elif kind == "http":
+		backend = HTTPBackend(options["url"], options.get("api_key"), timeout, pool_size)
+	else:
+		raise ValueError(f"Unknown backend type {kind!r}")
+	retry = RetryPolicy(options.get("retries", 3), options.get("backoff", 0.5), options.get("max_backoff", 8.0))
+	breaker = CircuitBreaker(options.get("breaker_threshold", 5), options.get("breaker_reset", 30.0))
+	return ResilientBackend(backend, retry, breaker)
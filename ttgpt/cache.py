@@ -0,0 +1,133 @@
+"""Caching of completion responses for prompts that come up again and again."""
+
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def normalize_prompt(prompt):
+	"""Returns prompt in a form where trivially different phrasings compare equal.
+	Case, repeated whitespace and trailing punctuation are ignored."""
+	return " ".join(prompt.lower().split()).rstrip("?!. ")
+
+
+def cache_key(prompt, params, context=""):
+	"""Returns the key a response is cached under.
+	params are the parameters sent to the completion engine, context is any conversation history the prompt is sent with."""
+	context_hash = hashlib.sha256(context.encode()).hexdigest()
+	data = json.dumps([normalize_prompt(prompt), params, context_hash], sort_keys=True)
+	return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ResponseCache:
+	"""An LRU cache of responses with a time to live, bounded by the total size of the cached text in bytes.
+	If path is given, entries are also kept in a SQLite database there.
+	The database survives restarts and can be shared by several processes, it is bounded by disk_max_bytes.
+	Safe to use from multiple threads."""
+
+	def __init__(self, max_bytes=1024*1024, ttl=3600, path=None, disk_max_bytes=16*1024*1024):
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+		self.path = path
+		self.disk_max_bytes = disk_max_bytes
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.size = 0
+		# key -> (value, expires, size), least recently used first
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+		self._db = None
+		if path:
+			self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+			self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, expires REAL, size INTEGER, used REAL)")
+			self._db.commit()
+
+	def get(self, key):
+		"""Returns the cached response for key, or None"""
+		now = time.time()
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry:
+				if entry[1] > now:
+					self._entries.move_to_end(key)
+					self.hits += 1
+					return entry[0]
+				self._remove(key)
+			if self._db:
+				row = self._db.execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+				if row and row[1] > now:
+					self._db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+					self._db.commit()
+					self._insert(key, row[0], row[1])
+					self.hits += 1
+					self.disk_hits += 1
+					return row[0]
+			self.misses += 1
+			return None
+
+	def put(self, key, value):
+		"""Caches value under key"""
+		now = time.time()
+		expires = now + self.ttl
+		with self._lock:
+			self._insert(key, value, expires)
+			if self._db:
+				size = len(value.encode())
+				self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, value, expires, size, now))
+				self._trim_disk(now)
+				self._db.commit()
+
+	def _insert(self, key, value, expires):
+		size = len(value.encode())
+		if size > self.max_bytes:
+			return
+		if key in self._entries:
+			self._remove(key)
+		self._entries[key] = (value, expires, size)
+		self.size += size
+		while self.size > self.max_bytes:
+			oldest = next(iter(self._entries))
+			self._remove(oldest)
+			self.evictions += 1
+
+	def _remove(self, key):
+		value, expires, size = self._entries.pop(key)
+		self.size -= size
+
+	def _trim_disk(self, now):
+		self._db.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+		total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+		if total <= self.disk_max_bytes:
+			return
+		# drop the least recently used entries until we fit again
+		for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY used").fetchall():
+			if total <= self.disk_max_bytes:
+				break
+			self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+			total -= size
+
+	def stats(self):
+		"""Returns a dict of counters describing how well the cache is doing"""
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"hits": self.hits,
+				"disk_hits": self.disk_hits,
+				"misses": self.misses,
+				"hit_ratio": self.hits / lookups if lookups else 0.0,
+				"evictions": self.evictions,
+				"entries": len(self._entries),
+				"bytes": self.size,
+			}
+
+	def close(self):
+		"""Closes the on-disk backend, if any"""
+		if self._db:
+			self._db.close()
+			self._db = None
@@ -0,0 +1,165 @@
+"""Splitting replies into messages short enough for TeamTalk.
+
+The server limits messages by their size in bytes once encoded as UTF-8, not by their length in characters, so limits here are in bytes.
+Messages are cut at the last paragraph break that fits, then the last sentence end, then the last space, and only in the middle of a word if there is no other choice.
+A boundary is only used if it leaves the message at least half full, so a paragraph break near the start doesn't produce a tiny message.
+Text is encoded once and boundaries are searched for backwards from where the message has to end, in the UTF-8 bytes.
+Every boundary is an ASCII character, and those never appear inside a multibyte character, so cuts always fall between characters.
+"""
+
+
+import re
+
+
+# no character takes more than 4 bytes, so this is the smallest limit every character fits in
+MIN_LIMIT = 4
+
+_SENTENCE_MARKS = (b".", b"!", b"?")
+# what can follow a sentence's punctuation and still end it, E.G. the closing quote in: He said "hi."
+_SENTENCE_TAIL = b".!?\"')]"
+# bytes.isspace() and \s in a bytes pattern agree on these
+_WHITESPACE = b" \t\n\r\x0b\x0c"
+_LEADING_SPACE_RE = re.compile(rb"\s*")
+
+
+def _check_limit(limit):
+	if limit < MIN_LIMIT:
+		raise ValueError(f"limit must be at least {MIN_LIMIT} bytes, so any character fits in a message, not {limit}")
+
+
+def _fit(data, pos, limit):
+	"""Returns the index just past the longest run of whole characters from pos that is at most limit bytes,
+	or None if everything from pos fits"""
+	end = pos + limit
+	if end >= len(data):
+		return None
+	# don't cut a character in half, back up to the start of the one that doesn't fit
+	while data[end] & 0xC0 == 0x80:
+		end -= 1
+	return end
+
+
+def _paragraph_break(data, least, end):
+	"""Returns the start of the last blank line (which may hold spaces or tabs) in data[least:end], or -1"""
+	newline = data.rfind(b"\n", least, end)
+	while newline != -1:
+		start = newline - 1
+		while start >= least and data[start] in b" \t":
+			start -= 1
+		if start >= least and data[start] == 0x0A:
+			return start
+		newline = data.rfind(b"\n", least, newline)
+	return -1
+
+
+def _sentence_end(data, least, end):
+	"""Returns the end of the last sentence in data[least:end], just past its punctuation, or the last line break if that comes later.
+	Returns -1 if there is neither"""
+	best = data.rfind(b"\n", least, end)
+	for mark in _SENTENCE_MARKS:
+		# only a later sentence end than the best so far is any use
+		start = max(least, best)
+		found = data.rfind(mark, start, end)
+		while found != -1:
+			boundary = found + 1
+			while boundary < end and data[boundary] in _SENTENCE_TAIL:
+				boundary += 1
+			# punctuation only ends a sentence if whitespace follows, so the dot in 3.14 doesn't count
+			if boundary < end and data[boundary] in _WHITESPACE:
+				best = max(best, boundary)
+				break
+			found = data.rfind(mark, start, found)
+	return best
+
+
+def _space(data, least, end):
+	"""Returns the index of the last space or tab in data[least:end], or -1"""
+	return max(data.rfind(b" ", least, end), data.rfind(b"\t", least, end))
+
+
+def _cut(data, pos, limit):
+	"""Returns (end, next) for the message starting at pos: the message is data[pos:end] and the one after it starts at next.
+	Returns None if the rest of data fits in one message"""
+	end = _fit(data, pos, limit)
+	if end is None:
+		return None
+	least = pos + (end - pos) // 2
+	for search in (_paragraph_break, _sentence_end, _space):
+		boundary = search(data, least, end)
+		if boundary != -1:
+			end = boundary
+			break
+	return end, _LEADING_SPACE_RE.match(data, end).end()
+
+
+def _split(data, pos, limit, chunks):
+	"""Appends every complete message in data (UTF-8) from pos to chunks, returning where the unfinished rest starts"""
+	while True:
+		cut = _cut(data, pos, limit)
+		if cut is None:
+			return pos
+		end, start = cut
+		chunk = data[pos:end].decode("utf-8").strip()
+		if chunk:
+			chunks.append(chunk)
+		pos = start
+
+
+def split_text(text, limit=500):
+	"""Splits text into messages of at most limit bytes.
+	Whitespace where a message was cut is dropped, and messages that would be empty are left out.
+	Raises ValueError if limit is below MIN_LIMIT."""
+	_check_limit(limit)
+	data = text.encode("utf-8")
+	chunks = []
+	pos = _split(data, _LEADING_SPACE_RE.match(data).end(), limit, chunks)
+	rest = data[pos:].decode("utf-8").strip()
+	if rest:
+		chunks.append(rest)
+	return chunks
+
+
+class StreamChunker:
+	"""Cuts text arriving in pieces (E.G. a streamed completion) into messages of at most limit bytes, the same way split_text would.
+	A message is released as soon as enough text has arrived to fill it, rather than waiting for the whole reply.
+	Raises ValueError if limit is below MIN_LIMIT."""
+
+	def __init__(self, limit=500):
+		_check_limit(limit)
+		self.limit = limit
+		# encoded pieces
+		self._pieces = []
+		# bytes waiting in _pieces
+		self._size = 0
+		# whether we're still skipping whitespace at the start of a message
+		self._skip_space = True
+
+	def feed(self, text):
+		"""Adds text to the buffer and returns a list of any messages that are now complete"""
+		data = text.encode("utf-8")
+		if self._skip_space:
+			data = data.lstrip()
+			if not data:
+				return []
+			self._skip_space = False
+		self._pieces.append(data)
+		self._size += len(data)
+		# nothing can be cut until there is more than a message's worth
+		if self._size <= self.limit:
+			return []
+		buffer = b"".join(self._pieces)
+		chunks = []
+		pos = _split(buffer, 0, self.limit, chunks)
+		rest = buffer[pos:]
+		self._pieces = [rest] if rest else []
+		self._size = len(rest)
+		self._skip_space = not rest
+		return chunks
+
+	def flush(self):
+		"""Returns whatever is left in the buffer as the final messages"""
+		rest = b"".join(self._pieces).decode("utf-8").strip()
+		self._pieces = []
+		self._size = 0
+		self._skip_space = True
+		return [rest] if rest else []
@@ -0,0 +1,158 @@
+"""Keep-alive HTTP connections shared between completion requests."""
+
+
+import time
+import socket
+import threading
+import http.client
+import urllib.parse
+
+
+# errors that mean a kept-alive connection was closed by the other end while it sat idle
+_STALE_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class DeadlineExceeded(TimeoutError):
+	"""Raised when a request doesn't finish before its deadline"""
+
+
+class PooledResponse:
+	"""A response from a ConnectionPool.
+	The connection goes back to the pool once the response has been read completely and closed (or used as a context manager)"""
+
+	def __init__(self, pool, connection, response, deadline):
+		self.pool = pool
+		self.connection = connection
+		self.response = response
+		self.deadline = deadline
+		self.status = response.status
+		self.reason = response.reason
+		self._released = False
+
+	def _arm(self):
+		"""Limits the next blocking read to whatever is left before the deadline"""
+		if self.deadline is None:
+			return
+		remaining = self.deadline - time.monotonic()
+		if remaining <= 0:
+			raise DeadlineExceeded("Request deadline exceeded")
+		if self.connection.sock:
+			self.connection.sock.settimeout(remaining)
+
+	def read(self):
+		self._arm()
+		return self.response.read()
+
+	def __iter__(self):
+		while True:
+			self._arm()
+			line = self.response.readline()
+			if not line:
+				return
+			yield line
+
+	def close(self):
+		if self._released:
+			return
+		self._released = True
+		reusable = self.response.isclosed() and not self.response.will_close
+		if not reusable:
+			self.response.close()
+		self.pool._release(self.connection, reusable)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+class ConnectionPool:
+	"""Up to size keep-alive connections to the host in url, reused between requests so that each one doesn't pay for a new TCP (and TLS) handshake.
+	timeout is the default deadline, in seconds, for a whole request including reading the response.
+	Safe to use from multiple threads."""
+
+	def __init__(self, url, size=10, timeout=60):
+		parts = urllib.parse.urlsplit(url)
+		self.scheme = parts.scheme
+		self.host = parts.hostname
+		self.port = parts.port
+		self.path = parts.path.rstrip("/")
+		self.size = size
+		self.timeout = timeout
+		self.created = 0
+		self.reused = 0
+		self._idle = []
+		self._lock = threading.Lock()
+		self._slots = threading.BoundedSemaphore(size)
+
+	def _connect(self, timeout):
+		self.created += 1
+		if self.scheme == "https":
+			return http.client.HTTPSConnection(self.host, self.port, timeout=timeout)
+		return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+	def _acquire(self, deadline):
+		remaining = deadline - time.monotonic() if deadline is not None else None
+		if not self._slots.acquire(timeout=remaining if remaining is None else max(remaining, 0)):
+			raise DeadlineExceeded("Timed out waiting for a free connection")
+		with self._lock:
+			if self._idle:
+				self.reused += 1
+				return self._idle.pop(), True
+		return self._connect(remaining), False
+
+	def _release(self, connection, reusable):
+		if reusable:
+			with self._lock:
+				self._idle.append(connection)
+		else:
+			connection.close()
+		self._slots.release()
+
+	def request(self, method, path, body=None, headers=None, timeout=None):
+		"""Sends a request for path (relative to the url the pool was created with).
+		Returns a PooledResponse, which must be closed to give the connection back.
+		timeout overrides the pool's default deadline for this request"""
+		timeout = self.timeout if timeout is None else timeout
+		deadline = time.monotonic() + timeout if timeout is not None else None
+		connection, reused = self._acquire(deadline)
+		try:
+			while True:
+				if deadline is not None:
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						raise DeadlineExceeded("Request deadline exceeded")
+					connection.timeout = remaining
+					if connection.sock:
+						connection.sock.settimeout(remaining)
+				try:
+					connection.request(method, self.path + path, body, headers or {})
+					response = connection.getresponse()
+				except _STALE_ERRORS:
+					if not reused:
+						raise
+					# the server dropped the idle connection, try once more on a fresh one
+					connection.close()
+					connection, reused = self._connect(connection.timeout), False
+					continue
+				return PooledResponse(self, connection, response, deadline)
+		except socket.timeout as e:
+			connection.close()
+			self._slots.release()
+			raise DeadlineExceeded("Request deadline exceeded") from e
+		except BaseException:
+			connection.close()
+			self._slots.release()
+			raise
+
+	def close(self):
+		"""Closes every idle connection"""
+		with self._lock:
+			idle, self._idle = self._idle, []
+		for connection in idle:
+			connection.close()
+
+	def stats(self):
+		with self._lock:
+			return {"size": self.size, "idle": len(self._idle), "created": self.created, "reused": self.reused}
@@ -0,0 +1,72 @@
+"""Fitting conversation history into a completion prompt."""
+
+
+from collections import namedtuple
+
+import tiktoken
+
+
+# text is the full prompt, context is the part of it that came from history
+Prompt = namedtuple("Prompt", ("text", "max_tokens", "context"))
+
+
+def format_exchange(user, reply):
+	"""Returns an exchange as it appears in a prompt"""
+	return f"User: {user}\nAssistant: {reply}\n\n"
+
+
+def format_question(user):
+	"""Returns the new message as it appears at the end of a prompt"""
+	return f"User: {user}\nAssistant:"
+
+
+class TokenCounter:
+	"""Counts tokens the way the given model does"""
+
+	def __init__(self, model="text-davinci-003"):
+		self.encoding = tiktoken.encoding_for_model(model)
+
+	def count(self, text):
+		return len(self.encoding.encode(text))
+
+	def count_exchange(self, exchange):
+		"""Returns the number of tokens exchange takes up in a prompt.
+		The count is cached on the exchange under "tokens", so history is only ever counted once"""
+		tokens = exchange.get("tokens")
+		if tokens is None:
+			tokens = exchange["tokens"] = self.count(format_exchange(exchange["user"], exchange["reply"]))
+		return tokens
+
+
+class ContextBuilder:
+	"""Builds prompts out of a conversation's history without going over the model's context size.
+	context_tokens is the size of the model's context window, shared between the prompt and the reply.
+	The reply gets at most max_reply_tokens, and history is dropped (oldest first) to leave it at least min_reply_tokens.
+	max_history_tokens optionally bounds how much history is sent, regardless of the space available."""
+
+	def __init__(self, counter, context_tokens=4097, max_reply_tokens=2000, min_reply_tokens=256, max_history_tokens=None):
+		self.counter = counter
+		self.context_tokens = context_tokens
+		self.max_reply_tokens = max_reply_tokens
+		self.min_reply_tokens = min_reply_tokens
+		self.max_history_tokens = max_history_tokens
+
+	def build(self, history, user):
+		"""Returns a Prompt for the message user, preceded by as much of history (a list of exchanges, oldest first) as fits"""
+		question = format_question(user)
+		used = self.counter.count(question)
+		budget = self.context_tokens - self.min_reply_tokens - used
+		if self.max_history_tokens is not None:
+			budget = min(budget, self.max_history_tokens)
+		# walk back from the newest exchange, only the ones we keep are ever looked at
+		kept = []
+		for exchange in reversed(history):
+			tokens = self.counter.count_exchange(exchange)
+			if tokens > budget:
+				break
+			budget -= tokens
+			used += tokens
+			kept.append(exchange)
+		context = "".join(format_exchange(exchange["user"], exchange["reply"]) for exchange in reversed(kept))
+		max_tokens = max(min(self.max_reply_tokens, self.context_tokens - used), 1)
+		return Prompt(context + question, max_tokens, context)
@@ -0,0 +1,172 @@
+"""A local stand-in for the OpenAI completions API, for load testing without network access.
+
+Speaks enough of the protocol for ttgpt.HTTPBackend and the openai module (with api_base pointed at it), including streaming.
+Run it on its own with:
+	python -m ttgpt.fake_server --port 8080 --latency 0.5 --failure-rate 0.05
+"""
+
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+WORDS = (
+	"the quick brown fox jumps over the lazy dog while a small bird sings in the old oak tree. "
+	"meanwhile the river keeps flowing past the quiet village and nobody seems to notice. "
+).split(" ")
+
+
+class FakeCompletionServer:
+	"""Serves made up completions over HTTP.
+	latency is how long (in seconds) before the first piece of a reply, tokens_per_second how fast the rest is generated.
+	failure_rate is the fraction of requests that fail, with failure_status.
+	Replies are reply_tokens words long (or max_tokens, if smaller).
+	Streamed replies end by closing the connection, unless keep_alive is set, which sends them chunked and keeps it open like the OpenAI API does."""
+
+	def __init__(self, host="127.0.0.1", port=0, latency=0.5, tokens_per_second=50, failure_rate=0.0, failure_status=500, reply_tokens=100, keep_alive=False):
+		self.latency = latency
+		self.tokens_per_second = tokens_per_second
+		self.failure_rate = failure_rate
+		self.failure_status = failure_status
+		self.reply_tokens = reply_tokens
+		self.keep_alive = keep_alive
+		self.requests = 0
+		self.failures = 0
+		self._lock = threading.Lock()
+		self._thread = None
+		self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+		self.httpd.daemon_threads = True
+
+	@property
+	def url(self):
+		"""The API root to give to HTTPBackend (or openai.api_base)"""
+		host, port = self.httpd.server_address[:2]
+		return f"http://{host}:{port}/v1"
+
+	def _make_handler(self):
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1"
+			# headers and body are written separately, Nagle would hold the body back until the client's delayed ACK
+			disable_nagle_algorithm = True
+
+			def log_message(self, format, *args):
+				pass
+
+			def do_POST(self):
+				length = int(self.headers.get("Content-Length", 0))
+				try:
+					request = json.loads(self.rfile.read(length) or b"{}")
+				except ValueError:
+					return self._error(400, "invalid JSON")
+				if not self.path.rstrip("/").endswith("/completions"):
+					return self._error(404, "not found")
+				server._handle(self, request)
+
+			def _error(self, status, message):
+				body = json.dumps({"error": {"message": message, "type": "fake_error"}}).encode()
+				self.send_response(status)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+		return Handler
+
+	def _reply(self, request):
+		count = min(self.reply_tokens, int(request.get("max_tokens", 16)))
+		words = [WORDS[i % len(WORDS)] for i in range(count)]
+		return ["\n\n"] + [word + " " for word in words]
+
+	def _handle(self, handler, request):
+		with self._lock:
+			self.requests += 1
+			fail = random.random() < self.failure_rate
+			if fail:
+				self.failures += 1
+		time.sleep(self.latency)
+		if fail:
+			return handler._error(self.failure_status, "simulated failure")
+		pieces = self._reply(request)
+		model = request.get("model", "fake")
+		if not request.get("stream"):
+			time.sleep(len(pieces) / self.tokens_per_second)
+			body = json.dumps({
+				"object": "text_completion",
+				"model": model,
+				"choices": [{"text": "".join(pieces), "index": 0, "finish_reason": "length"}],
+			}).encode()
+			handler.send_response(200)
+			handler.send_header("Content-Type", "application/json")
+			handler.send_header("Content-Length", str(len(body)))
+			handler.end_headers()
+			handler.wfile.write(body)
+			return
+		handler.send_response(200)
+		handler.send_header("Content-Type", "text/event-stream")
+		if self.keep_alive:
+			handler.send_header("Transfer-Encoding", "chunked")
+		else:
+			# no content length, so the connection ends with the stream
+			handler.send_header("Connection", "close")
+			handler.close_connection = True
+		handler.end_headers()
+
+		def write(data):
+			if self.keep_alive:
+				data = b"%x\r\n%s\r\n" % (len(data), data)
+			handler.wfile.write(data)
+			handler.wfile.flush()
+
+		for piece in pieces:
+			event = {"object": "text_completion", "model": model, "choices": [{"text": piece, "index": 0, "finish_reason": None}]}
+			write(b"data: " + json.dumps(event).encode() + b"\n\n")
+			time.sleep(1 / self.tokens_per_second)
+		write(b"data: [DONE]\n\n")
+		if self.keep_alive:
+			# the empty chunk that ends the body
+			handler.wfile.write(b"0\r\n\r\n")
+			handler.wfile.flush()
+
+	def start(self):
+		"""Serves requests on a background thread"""
+		self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-completion-server")
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Serve fake completions for load testing")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8080)
+	parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first piece of a reply")
+	parser.add_argument("--tokens-per-second", type=float, default=50)
+	parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests that fail")
+	parser.add_argument("--failure-status", type=int, default=500)
+	parser.add_argument("--reply-tokens", type=int, default=100)
+	parser.add_argument("--keep-alive", action="store_true", help="send streamed replies chunked and keep the connection open")
+	args = parser.parse_args(argv)
+	server = FakeCompletionServer(
+		args.host, args.port, args.latency, args.tokens_per_second, args.failure_rate, args.failure_status, args.reply_tokens, args.keep_alive
+	)
+	print(f"Serving fake completions on {server.url}")
+	try:
+		server.httpd.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
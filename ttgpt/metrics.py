@@ -0,0 +1,276 @@
+"""Metrics in the Prometheus text format, and a trace log of TeamTalk events.
+
+Metrics are kept in a MetricsRegistry, and served to Prometheus (or curl) by a MetricsServer:
+	registry = MetricsRegistry()
+	replies = registry.counter("ttgpt_replies_total", "Replies sent", ("outcome",))
+	replies.inc(outcome="completed")
+	MetricsServer(registry, port=9100).start()
+Values that already live elsewhere (queue depths, counters kept by other objects) are better read when scraped, with add_collector.
+"""
+
+
+import json
+import time
+import bisect
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _escape(value):
+	return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+	if value == float("inf"):
+		return "+Inf"
+	if value == float("-inf"):
+		return "-Inf"
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+	if not labels:
+		return ""
+	return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Metric:
+	"""Base class for metrics.
+	labelnames are the labels every sample must be given, as keyword arguments to inc, set, observe, etc."""
+
+	type = "untyped"
+
+	def __init__(self, name, help="", labelnames=()):
+		self.name = name
+		self.help = help
+		self.labelnames = tuple(labelnames)
+		# label values -> value
+		self._values = {}
+		self._lock = threading.Lock()
+
+	def _key(self, labels):
+		if len(labels) != len(self.labelnames):
+			raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+		return tuple(str(labels[name]) for name in self.labelnames)
+
+	def get(self, **labels):
+		"""Returns the current value for labels"""
+		with self._lock:
+			return self._values.get(self._key(labels), 0)
+
+	def samples(self):
+		"""Yields (name, labels, value) for every sample, labels being a tuple of (name, value) pairs"""
+		with self._lock:
+			values = list(self._values.items())
+		for key, value in values:
+			yield self.name, tuple(zip(self.labelnames, key)), value
+
+	def render(self):
+		"""Returns the metric in the Prometheus text format"""
+		lines = [f"# HELP {self.name} {_escape(self.help)}", f"# TYPE {self.name} {self.type}"]
+		for name, labels, value in self.samples():
+			lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+		return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+	"""A value that only goes up, E.G. the number of replies sent"""
+
+	type = "counter"
+
+	def inc(self, amount=1, **labels):
+		if amount < 0:
+			raise ValueError("Counters can't go down")
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+	"""A value that goes up and down, E.G. a queue depth"""
+
+	type = "gauge"
+
+	def set(self, value, **labels):
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = value
+
+	def inc(self, amount=1, **labels):
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def dec(self, amount=1, **labels):
+		self.inc(-amount, **labels)
+
+
+# suits anything from a parse (milliseconds) to a completion (tens of seconds)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram(Metric):
+	"""Counts observations (E.G. request durations) into buckets, each counting the observations up to its upper bound.
+	Also keeps the sum and count of every observation, so averages can be worked out."""
+
+	type = "histogram"
+
+	def __init__(self, name, help="", labelnames=(), buckets=DEFAULT_BUCKETS):
+		super().__init__(name, help, labelnames)
+		self.buckets = tuple(sorted(buckets))
+
+	def observe(self, value, **labels):
+		key = self._key(labels)
+		with self._lock:
+			data = self._values.get(key)
+			if data is None:
+				# a count per bucket plus one for anything larger, then the sum
+				data = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+			data[bisect.bisect_left(self.buckets, value)] += 1
+			data[-1] += value
+
+	@contextlib.contextmanager
+	def time(self, **labels):
+		"""Observes how long the with block takes"""
+		started = time.monotonic()
+		try:
+			yield
+		finally:
+			self.observe(time.monotonic() - started, **labels)
+
+	def get(self, **labels):
+		"""Returns (count, sum) of the observations for labels"""
+		with self._lock:
+			data = self._values.get(self._key(labels))
+			if data is None:
+				return 0, 0.0
+			return sum(data[:-1]), data[-1]
+
+	def samples(self):
+		with self._lock:
+			values = [(key, list(data)) for key, data in self._values.items()]
+		for key, data in values:
+			labels = tuple(zip(self.labelnames, key))
+			total = 0
+			for bound, count in zip(self.buckets + (float("inf"),), data):
+				total += count
+				yield self.name + "_bucket", labels + (("le", _format_value(float(bound))),), total
+			yield self.name + "_sum", labels, data[-1]
+			yield self.name + "_count", labels, total
+
+
+class MetricsRegistry:
+	"""A set of metrics, rendered together.
+	Collectors are functions called on every render, returning a list of extra metrics (usually freshly made ones filled in from elsewhere).
+	Safe to use from multiple threads."""
+
+	def __init__(self):
+		self._metrics = {}
+		self._collectors = []
+		self._lock = threading.Lock()
+
+	def register(self, metric):
+		"""Adds metric to the registry and returns it"""
+		with self._lock:
+			if metric.name in self._metrics:
+				raise ValueError(f"A metric named {metric.name} is already registered")
+			self._metrics[metric.name] = metric
+		return metric
+
+	def counter(self, name, help="", labelnames=()):
+		return self.register(Counter(name, help, labelnames))
+
+	def gauge(self, name, help="", labelnames=()):
+		return self.register(Gauge(name, help, labelnames))
+
+	def histogram(self, name, help="", labelnames=(), buckets=DEFAULT_BUCKETS):
+		return self.register(Histogram(name, help, labelnames, buckets))
+
+	def add_collector(self, collector):
+		self._collectors.append(collector)
+
+	def render(self):
+		"""Returns every metric in the Prometheus text format"""
+		with self._lock:
+			metrics = list(self._metrics.values())
+		for collector in list(self._collectors):
+			metrics.extend(collector())
+		return "".join(metric.render() for metric in metrics)
+
+
+class MetricsServer:
+	"""Serves the metrics in registry over HTTP, at /metrics.
+	Binds to localhost by default, the numbers aren't secret but they aren't anybody else's business either."""
+
+	def __init__(self, registry, host="127.0.0.1", port=9100):
+		self.registry = registry
+		self._thread = None
+		self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+		self.httpd.daemon_threads = True
+
+	@property
+	def url(self):
+		host, port = self.httpd.server_address[:2]
+		return f"http://{host}:{port}/metrics"
+
+	def _make_handler(self):
+		registry = self.registry
+
+		class Handler(BaseHTTPRequestHandler):
+			def log_message(self, format, *args):
+				pass
+
+			def do_GET(self):
+				if self.path.split("?")[0] not in ("/metrics", "/"):
+					self.send_error(404)
+					return
+				body = registry.render().encode()
+				self.send_response(200)
+				self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+		return Handler
+
+	def start(self):
+		"""Serves requests on a background thread"""
+		self._thread = threading.Thread(target=self.httpd.serve_forever, name="metrics-server")
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+
+class TraceLog:
+	"""Writes a JSON line for every TeamTalk event, for working out where time goes.
+	Set an instance as a TeamTalkServer's trace attribute.
+	Each line holds the time, server, event and milliseconds spent parsing and dispatching it. Parameters (which include message contents) are only written if params is True."""
+
+	def __init__(self, path, params=False):
+		self.params = params
+		self._file = open(path, "a", encoding="utf-8")
+		self._lock = threading.Lock()
+
+	def __call__(self, server, event, params, parse_time, dispatch_time):
+		record = {
+			"time": time.time(),
+			"server": f"{server.host}:{server.tcpport}",
+			"event": event,
+			"parse_ms": round(parse_time * 1000, 3),
+			"dispatch_ms": round(dispatch_time * 1000, 3),
+		}
+		if self.params:
+			record["params"] = dict(params)
+		line = json.dumps(record, default=str) + "\n"
+		with self._lock:
+			if not self._file.closed:
+				self._file.write(line)
+
+	def close(self):
+		with self._lock:
+			self._file.close()
@@ -0,0 +1,211 @@
+"""Append-only storage for conversation history.
+
+Every conversation gets its own journal file of JSON lines, one record per change:
+	{"user": "...", "reply": "...", "tokens": 42}	an exchange was added, tokens is optional
+	{"op": "reset"}	the conversation was cleared
+	{"op": "rollback", "n": 2}	the last n exchanges were removed
+Records are batched in memory and appended on a timer, so a reply never waits on the disk.
+Journals are rewritten (compacted) in the background once they hold much more than the live history.
+Nothing is read from disk until a conversation is first used.
+"""
+
+
+import os
+import json
+import time
+import threading
+
+
+class ConversationStore:
+	"""Keeps the history of every conversation and persists it to directory.
+	History is a list of exchanges, dicts with "user" and "reply" keys, oldest first.
+	flush_interval is how often (in seconds) pending records are written, batch_size forces an early flush once that many records are waiting.
+	A journal is compacted once it holds more than compact_ratio times as many records as there are exchanges (and at least compact_min records).
+	If max_exchanges is set, only that many of the most recent exchanges are kept.
+	Safe to use from multiple threads."""
+
+	def __init__(self, directory, flush_interval=1.0, batch_size=64, compact_ratio=2.0, compact_min=32, max_exchanges=None):
+		self.directory = directory
+		self.flush_interval = flush_interval
+		self.batch_size = batch_size
+		self.compact_ratio = compact_ratio
+		self.compact_min = compact_min
+		self.max_exchanges = max_exchanges
+		os.makedirs(directory, exist_ok=True)
+		self._lock = threading.Lock()
+		# held while writing journals, so a flush can't append to one that's being rewritten
+		# always taken before _lock, and never by get or add, which only wait for memory
+		self._disk_lock = threading.Lock()
+		# conversation id -> list of exchanges, only for conversations that have been loaded
+		self._conversations = {}
+		# conversation id -> number of records in its journal on disk (including pending ones)
+		self._journal_length = {}
+		# conversation id -> list of records waiting to be written
+		self._pending = {}
+		self._pending_count = 0
+		# counters for stats, times are in seconds
+		self.flushes = 0
+		self.flush_time = 0.0
+		self.last_flush_time = 0.0
+		self.records_written = 0
+		self.compactions = 0
+		self._wakeup = threading.Event()
+		self._closed = False
+		self._thread = threading.Thread(target=self._run, name="conversation-store")
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _path(self, conversation_id):
+		return os.path.join(self.directory, conversation_id + ".jsonl")
+
+	def _load(self, conversation_id):
+		"""Returns the history for conversation_id, reading its journal if we haven't yet.
+		Must be called with the lock held"""
+		history = self._conversations.get(conversation_id)
+		if history is not None:
+			return history
+		history = []
+		length = 0
+		try:
+			with open(self._path(conversation_id), encoding="utf-8") as f:
+				for line in f:
+					try:
+						record = json.loads(line)
+					except ValueError:
+						# most likely a partial write from a crash, the rest of the journal is still good
+						continue
+					length += 1
+					self._apply(history, record)
+		except FileNotFoundError:
+			pass
+		self._conversations[conversation_id] = history
+		self._journal_length[conversation_id] = length
+		return history
+
+	def _apply(self, history, record):
+		op = record.get("op")
+		if op is None:
+			exchange = {"user": record["user"], "reply": record["reply"]}
+			if "tokens" in record:
+				exchange["tokens"] = record["tokens"]
+			history.append(exchange)
+			if self.max_exchanges and len(history) > self.max_exchanges:
+				del history[:len(history) - self.max_exchanges]
+		elif op == "reset":
+			history.clear()
+		elif op == "rollback":
+			del history[max(len(history) - record["n"], 0):]
+
+	def _record(self, conversation_id, record):
+		"""Applies record to the in-memory history and queues it for writing.
+		Must be called with the lock held"""
+		self._apply(self._load(conversation_id), record)
+		self._pending.setdefault(conversation_id, []).append(record)
+		self._journal_length[conversation_id] += 1
+		self._pending_count += 1
+		if self._pending_count >= self.batch_size:
+			self._wakeup.set()
+
+	def get(self, conversation_id):
+		"""Returns a copy of the history for conversation_id"""
+		with self._lock:
+			return list(self._load(conversation_id))
+
+	def add(self, conversation_id, user, reply, tokens=None):
+		"""Records an exchange between a user and the bot.
+		tokens is the number of tokens the exchange takes up in a prompt, if known"""
+		record = {"user": user, "reply": reply}
+		if tokens is not None:
+			record["tokens"] = tokens
+		with self._lock:
+			self._record(conversation_id, record)
+
+	def reset(self, conversation_id):
+		"""Clears the history for conversation_id"""
+		with self._lock:
+			self._record(conversation_id, {"op": "reset"})
+
+	def rollback(self, conversation_id, n):
+		"""Removes the last n exchanges from conversation_id.
+		Returns how many were actually removed, which is less than n if the history was shorter"""
+		with self._lock:
+			removed = min(n, len(self._load(conversation_id)))
+			self._record(conversation_id, {"op": "rollback", "n": n})
+			return removed
+
+	def flush(self):
+		"""Writes every pending record to disk"""
+		with self._disk_lock:
+			with self._lock:
+				pending = self._pending
+				self._pending = {}
+				self._pending_count = 0
+			if not pending:
+				return
+			started = time.monotonic()
+			for conversation_id, records in pending.items():
+				data = "".join(json.dumps(record) + "\n" for record in records)
+				with open(self._path(conversation_id), "a", encoding="utf-8") as f:
+					f.write(data)
+				self.records_written += len(records)
+			self.last_flush_time = time.monotonic() - started
+			self.flush_time += self.last_flush_time
+			self.flushes += 1
+
+	def compact(self):
+		"""Rewrites journals that have grown much larger than the history they describe"""
+		with self._lock:
+			candidates = [
+				conversation_id
+				for conversation_id, length in self._journal_length.items()
+				if length >= self.compact_min
+				and length > self.compact_ratio * len(self._conversations[conversation_id])
+				and conversation_id not in self._pending
+			]
+		for conversation_id in candidates:
+			with self._disk_lock:
+				with self._lock:
+					# new records may have arrived since we looked
+					if conversation_id in self._pending:
+						continue
+					history = list(self._conversations[conversation_id])
+				# written without the lock, so replies carry on while we wait for the disk
+				# anything added meanwhile stays pending, and is appended to the new journal by the next flush
+				path = self._path(conversation_id)
+				tmp = path + ".tmp"
+				with open(tmp, "w", encoding="utf-8") as f:
+					f.write("".join(json.dumps(exchange) + "\n" for exchange in history))
+				with self._lock:
+					os.replace(tmp, path)
+					self._journal_length[conversation_id] = len(history) + len(self._pending.get(conversation_id, ()))
+					self.compactions += 1
+
+	def stats(self):
+		"""Returns a dict of counters describing the store, times are in seconds"""
+		with self._lock:
+			return {
+				"conversations": len(self._conversations),
+				"pending": self._pending_count,
+				"flushes": self.flushes,
+				"flush_time": self.flush_time,
+				"last_flush_time": self.last_flush_time,
+				"records_written": self.records_written,
+				"compactions": self.compactions,
+			}
+
+	def _run(self):
+		while not self._closed:
+			self._wakeup.wait(self.flush_interval)
+			self._wakeup.clear()
+			try:
+				self.flush()
+				self.compact()
+			except OSError as e:
+				print(f"Failed to save conversations: {e}")
+
+	def close(self):
+		"""Stops the background thread and writes anything still pending"""
+		self._closed = True
+		self._wakeup.set()
+		self._thread.join()
+		self.flush()
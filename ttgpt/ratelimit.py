@@ -0,0 +1,123 @@
+"""Admission control for completion requests."""
+
+
+import time
+import threading
+
+
+class TokenBucket:
+	"""A classic token bucket.
+	Holds at most capacity tokens and refills at rate tokens per second.
+	Not thread safe on its own, RateLimiter serialises access."""
+
+	def __init__(self, rate, capacity):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated = time.monotonic()
+
+	def refill(self, now=None):
+		"""Adds the tokens that have accumulated since the last refill"""
+		now = time.monotonic() if now is None else now
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def wait_time(self, n=1, reserve=0):
+		"""Returns how long until n tokens can be taken without dropping below reserve, 0 if they can be taken now"""
+		missing = n + reserve - self.tokens
+		if missing <= 0:
+			return 0.0
+		if self.rate <= 0 or n + reserve > self.capacity:
+			return float("inf")
+		return missing / self.rate
+
+	def take(self, n=1):
+		self.tokens -= n
+
+	@property
+	def full(self):
+		return self.tokens >= self.capacity
+
+
+class RateLimiter:
+	"""Limits how quickly completions can be requested, globally, per user and per channel.
+	Each level is a TokenBucket described by a rate (requests per second) and a burst size.
+	A request must fit into every bucket it involves, and only then is a token taken from each.
+	Normal priority requests can't take the global bucket below priority_reserve tokens, keeping some room for priority ones (E.G. private messages) when a channel gets noisy.
+	Safe to use from multiple threads."""
+
+	def __init__(self, global_rate=1.0, global_burst=10, user_rate=0.1, user_burst=3, channel_rate=0.5, channel_burst=5, priority_reserve=2):
+		self.user_rate = user_rate
+		self.user_burst = user_burst
+		self.channel_rate = channel_rate
+		self.channel_burst = channel_burst
+		self.priority_reserve = priority_reserve
+		self.admitted = 0
+		self.limited = 0
+		self._global = TokenBucket(global_rate, global_burst)
+		self._users = {}
+		self._channels = {}
+		self._lock = threading.Lock()
+
+	def _bucket(self, buckets, key, rate, burst, now):
+		bucket = buckets.get(key)
+		if bucket is None:
+			if len(buckets) >= 1024:
+				self._prune(buckets, now)
+			bucket = buckets[key] = TokenBucket(rate, burst)
+		bucket.refill(now)
+		return bucket
+
+	def _prune(self, buckets, now):
+		"""Forgets buckets that have refilled completely, they behave exactly like new ones"""
+		for key, bucket in list(buckets.items()):
+			bucket.refill(now)
+			if bucket.full:
+				del buckets[key]
+
+	def try_acquire(self, user, channel=None, priority=False):
+		"""Attempts to admit a request from user (and channel, if it was sent to one).
+		Returns 0 if the request was admitted, otherwise the number of seconds until it would be"""
+		now = time.monotonic()
+		with self._lock:
+			self._global.refill(now)
+			buckets = [(self._global, 0 if priority else self.priority_reserve)]
+			buckets.append((self._bucket(self._users, user, self.user_rate, self.user_burst, now), 0))
+			if channel is not None:
+				buckets.append((self._bucket(self._channels, channel, self.channel_rate, self.channel_burst, now), 0))
+			wait = max(bucket.wait_time(1, reserve) for bucket, reserve in buckets)
+			if wait > 0:
+				self.limited += 1
+				return wait
+			for bucket, reserve in buckets:
+				bucket.take()
+			self.admitted += 1
+			return 0
+
+	def acquire(self, user, channel=None, priority=False, timeout=0):
+		"""Like try_acquire, but waits up to timeout seconds for the request to be admitted.
+		Returns 0 on success, otherwise the number of seconds until the request would be admitted"""
+		deadline = time.monotonic() + timeout
+		while True:
+			wait = self.try_acquire(user, channel, priority)
+			if wait == 0:
+				return 0
+			remaining = deadline - time.monotonic()
+			if wait > remaining:
+				return wait
+			time.sleep(wait)
+
+	def snapshot(self):
+		"""Returns the current level of every bucket"""
+		now = time.monotonic()
+		with self._lock:
+			self._global.refill(now)
+			for bucket in list(self._users.values()) + list(self._channels.values()):
+				bucket.refill(now)
+			return {
+				"global": self._global.tokens,
+				"users": {key: bucket.tokens for key, bucket in self._users.items()},
+				"channels": {key: bucket.tokens for key, bucket in self._channels.items()},
+				"admitted": self.admitted,
+				"limited": self.limited,
+			}
@@ -0,0 +1,72 @@
+"""Retrying failed completion requests, and not retrying when the upstream is down."""
+
+
+import time
+import random
+import threading
+
+
+class RetryPolicy:
+	"""Retries with exponential backoff and full jitter.
+	Attempt n (counting from 0) waits a random time between 0 and min(max_delay, base_delay * 2 ** n) before the next one.
+	Only errors with a status in retry_statuses, or no status at all (connection errors and timeouts), are retried."""
+
+	def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0, retry_statuses=(429, 500, 502, 503, 504)):
+		self.max_attempts = max_attempts
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+		self.retry_statuses = retry_statuses
+
+	def retryable(self, error):
+		status = getattr(error, "status", None)
+		return status is None or status in self.retry_statuses
+
+	def delay(self, attempt):
+		"""Returns how long to wait after the given (0 based) failed attempt"""
+		return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+	"""Fails fast once an upstream looks down.
+	After failure_threshold consecutive failures the circuit opens, and requests are refused for reset_timeout seconds.
+	After that a single trial request is let through, closing the circuit again if it succeeds.
+	Safe to use from multiple threads."""
+
+	CLOSED = "closed"
+	OPEN = "open"
+	HALF_OPEN = "half-open"
+
+	def __init__(self, failure_threshold=5, reset_timeout=30.0):
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		self.state = self.CLOSED
+		self.failures = 0
+		self.opened_at = 0.0
+		self._trial_running = False
+		self._lock = threading.Lock()
+
+	def allow(self):
+		"""Returns True if a request may be attempted right now"""
+		with self._lock:
+			if self.state == self.CLOSED:
+				return True
+			if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+				self.state = self.HALF_OPEN
+			if self.state == self.HALF_OPEN and not self._trial_running:
+				self._trial_running = True
+				return True
+			return False
+
+	def record_success(self):
+		with self._lock:
+			self.state = self.CLOSED
+			self.failures = 0
+			self._trial_running = False
+
+	def record_failure(self):
+		with self._lock:
+			self.failures += 1
+			self._trial_running = False
+			if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+				self.state = self.OPEN
+				self.opened_at = time.monotonic()
@@ -0,0 +1,88 @@
+"""Ordering and admission of requests within a conversation."""
+
+
+import threading
+import traceback
+from collections import deque
+
+
+# results of ConversationScheduler.submit
+QUEUED = "queued"
+MERGED = "merged"
+REJECTED = "rejected"
+
+
+class _Conversation:
+	__slots__ = ("queue", "running")
+
+	def __init__(self):
+		# (key, func) tuples waiting to run
+		self.queue = deque()
+		# key of the job currently running, None if it has no key
+		self.running = None
+
+
+class ConversationScheduler:
+	"""Runs jobs for each conversation one at a time, in the order they were submitted, on a shared executor.
+	Different conversations run concurrently.
+	At most max_pending jobs wait behind the running one, further jobs are rejected.
+	A job submitted with the same key as one that is already queued or running is merged into it instead, since it would produce the same answer.
+	Safe to use from multiple threads."""
+
+	def __init__(self, executor, max_pending=3):
+		self.executor = executor
+		self.max_pending = max_pending
+		self.merged = 0
+		self.rejected = 0
+		self._lock = threading.Lock()
+		# conversation id -> _Conversation, only for conversations with work queued or running
+		self._conversations = {}
+
+	def submit(self, conversation_id, func, key=None):
+		"""Schedules func() to run once every earlier job for conversation_id has finished.
+		Returns QUEUED, MERGED if an identical job (by key) was already waiting or running, or REJECTED if the queue is full."""
+		with self._lock:
+			conversation = self._conversations.get(conversation_id)
+			if conversation is None:
+				conversation = _Conversation()
+				conversation.queue.append((key, func))
+				self._conversations[conversation_id] = conversation
+				self.executor.submit(self._drain, conversation_id, conversation)
+				return QUEUED
+			if key is not None and (conversation.running == key or any(k == key for k, f in conversation.queue)):
+				self.merged += 1
+				return MERGED
+			if len(conversation.queue) >= self.max_pending:
+				self.rejected += 1
+				return REJECTED
+			conversation.queue.append((key, func))
+			return QUEUED
+
+	def _drain(self, conversation_id, conversation):
+		while True:
+			with self._lock:
+				if not conversation.queue:
+					del self._conversations[conversation_id]
+					return
+				key, func = conversation.queue.popleft()
+				conversation.running = key
+			try:
+				func()
+			except Exception:
+				traceback.print_exc()
+
+	def pending(self, conversation_id):
+		"""Returns how many jobs are waiting (not counting a running one) for conversation_id"""
+		with self._lock:
+			conversation = self._conversations.get(conversation_id)
+			return len(conversation.queue) if conversation else 0
+
+	def stats(self):
+		"""Returns a dict describing the scheduler's current load"""
+		with self._lock:
+			return {
+				"active_conversations": len(self._conversations),
+				"pending": sum(len(c.queue) for c in self._conversations.values()),
+				"merged": self.merged,
+				"rejected": self.rejected,
+			}
@@ -0,0 +1,83 @@
+"""Worker pool used to run completion requests away from the TeamTalk read loop."""
+
+
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class PoolFullError(Exception):
+	"""Raised when a job is submitted while the pool's queue is full"""
+
+
+class CompletionPool:
+	"""A fixed set of long lived worker threads fed from a bounded queue.
+	Create one at startup and share it between every request.
+	Callers get a concurrent.futures.Future back and can block on it without spinning."""
+
+	def __init__(self, workers=4, max_queue=32):
+		self.workers = workers
+		self.max_queue = max_queue
+		self._queue = queue.Queue(max_queue)
+		self._lock = threading.Lock()
+		self._in_flight = 0
+		self._closed = False
+		self._threads = []
+		for i in range(workers):
+			thread = threading.Thread(target=self._work, name=f"completion-worker-{i}")
+			thread.daemon = True
+			thread.start()
+			self._threads.append(thread)
+
+	@property
+	def queue_depth(self):
+		"""Number of jobs waiting for a free worker"""
+		return self._queue.qsize()
+
+	@property
+	def in_flight(self):
+		"""Number of jobs currently being executed"""
+		return self._in_flight
+
+	def submit(self, func, *args, block=False, timeout=None, **kwargs):
+		"""Schedules func(*args, **kwargs) to run on a worker and returns a Future for its result.
+		If the queue is full, raises PoolFullError immediately unless block is True, in which case we wait up to timeout seconds for room."""
+		if self._closed:
+			raise RuntimeError("Cannot submit to a pool that has been shut down")
+		future = Future()
+		try:
+			self._queue.put((future, func, args, kwargs), block, timeout)
+		except queue.Full:
+			raise PoolFullError(f"Completion queue is full ({self.max_queue} jobs waiting)") from None
+		return future
+
+	def _work(self):
+		while True:
+			job = self._queue.get()
+			if job is None:
+				# shutdown sentinel
+				break
+			future, func, args, kwargs = job
+			if not future.set_running_or_notify_cancel():
+				continue
+			with self._lock:
+				self._in_flight += 1
+			try:
+				result = func(*args, **kwargs)
+			except BaseException as e:
+				future.set_exception(e)
+			else:
+				future.set_result(result)
+			finally:
+				with self._lock:
+					self._in_flight -= 1
+
+	def shutdown(self, wait=True):
+		"""Stops accepting jobs and lets the workers exit once the queue has drained.
+		If wait is True, blocks until every worker has finished."""
+		self._closed = True
+		for _ in self._threads:
+			self._queue.put(None)
+		if wait:
+			for thread in self._threads:
+				thread.join()